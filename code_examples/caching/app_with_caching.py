@@ -1,9 +1,15 @@
 import streamlit as st
-import pandas as pd
 import plotly.express as px
 
+from cache_instrumentation import (instrumented_cache, show_instrumentation_panel, start_rerun,
+                                   timed_stage)
+from cached_loader import dataset_fingerprint, dataset_memory_report, load_dataset
+
 st.set_page_config(layout="wide")
 
+# Start timing this rerun - the results are shown in the sidebar (see cache_instrumentation.py)
+start_rerun()
+
 st.title("Caching Example - With Caching")
 
 st.write(
@@ -13,43 +19,118 @@ st.write(
     that the example *with* caching is a bit more responsive - the new graph will appear a bit
     quicker and you don't see the 'loading' message appearing at the top of the screen
     quite so much.
+
+    Open 'Performance measurements' in the sidebar to see how long each part of the app takes,
+    how often the cached functions are reused, and how much memory the cached data takes up.
     """
 )
 
+ATHLETE_DATA_PATH = "athlete_details_eventwise.csv"
+
 # To use streamlit's caching features, we need to do three main things:
 # 1. Add the @st.cache_data decorator
 # 2. Directly below this (i.e. no blank line first), define a function that loads in your
 #    dataset (from a relative path or from the web - either will work!) and make sure that
 #    it *returns* your dataset
-@st.cache_data
+#
+# e.g.
+#
+# @st.cache_data
+# def load_data():
+#     return pd.read_csv("athlete_details_eventwise.csv")
+#
+# Here we've gone one step further and used load_dataset from cached_loader.py. This is a
+# function with @st.cache_data on it just like the one above, but it also notices if the csv file
+# changes (and loads it again), limits how many datasets are kept in the cache, and saves a
+# Parquet copy of the file the first time, which is much quicker to load next time.
+# See cached_loader.py for details.
+#
+# Here we also tell pandas to store the Sport and Event columns as 'categoricals'. The same few
+# sport and event names are repeated on thousands of rows - a categorical stores each name just
+# once, which uses much less memory and makes grouping by these columns quicker.
 def load_data():
-    return pd.read_csv("athlete_details_eventwise.csv")
+    return load_dataset(
+        ATHLETE_DATA_PATH,
+        parquet_sidecar=True,
+        dtype={"Sport": "category", "Event": "category"}
+        )
 
-# 3. Finally, call this function and save the output to a variable with a name of your choosing
-# You can then use this like a standard dataframe throughout the rest of your script - Streamlit
-# handles the rest
-athlete_statistics = load_data()
+# Caching the data is a good start, but every time the user picks a different sport we would
+# still have to filter the whole dataset down to that sport and count the events again.
+# Instead, we can work out the answer for *every* sport in one go, the first time the app runs.
+# One groupby counts the number of different events for each sport in each year, and we then
+# store the results in a dictionary of sport -> table of events per year. Choosing a sport is
+# then just looking it up in the dictionary.
+# We also work out the list of sports for the dropdown, and the range of years for the graph.
+#
+# We use @st.cache_resource here rather than @st.cache_data. cache_data hands back a fresh copy
+# of what's stored every time the function is called, which would mean copying the tables for
+# every sport on every rerun. cache_resource hands back the stored dictionary itself - that's fine
+# here because we never change it, we only look things up in it.
+# (In this example we use @instrumented_cache(st.cache_resource) instead of @st.cache_resource -
+# this works in exactly the same way, but also counts how often the cache is used. See
+# cache_instrumentation.py for details)
+#
+# data_version isn't used inside the function - it's there so that when the csv file changes,
+# Streamlit sees a different argument and works the tables out again. max_entries=2 means we
+# don't keep the tables for old versions of the file hanging around.
+@instrumented_cache(st.cache_resource(max_entries=2))
+def get_events_per_year_by_sport(data_version):
+    athlete_statistics = load_data()
 
-selected_sport = st.selectbox("Select a sport",
-                              athlete_statistics["Sport"].drop_duplicates().tolist())
+    # observed=True means we only get sport/year combinations that actually appear in the data
+    events_per_year = (
+        athlete_statistics
+        .groupby(["Sport", "Year"], observed=True)["Event"]
+        .nunique()
+        .rename("count")
+        .reset_index()
+    )
 
-athlete_statistics_sport = athlete_statistics[athlete_statistics["Sport"] == selected_sport]
+    events_per_year_by_sport = {
+        sport: sport_events_per_year[["Year", "count"]].reset_index(drop=True)
+        for sport, sport_events_per_year
+        in events_per_year.groupby("Sport", observed=True)
+    }
 
-events_per_year_by_sport = (
-    athlete_statistics_sport[['Year', 'Event']]
-    .drop_duplicates()
-    .value_counts(['Year'])
-    .reset_index()
-)
+    # Keep the sports in the order they first appear in the data, like the original dropdown
+    sports = athlete_statistics["Sport"].drop_duplicates().tolist()
 
-st.plotly_chart(
-    px.line(events_per_year_by_sport.sort_values("Year"),
-            x="Year", y="count",
-            markers=True,
-            title=f"{selected_sport} Events Per Olympics",
-            range_x=[athlete_statistics.Year.min(), athlete_statistics.Year.max()])
-)
+    year_range = [athlete_statistics.Year.min(), athlete_statistics.Year.max()]
+
+    return sports, events_per_year_by_sport, year_range
+
+# 3. Finally, call this function and save the output to a variable with a name of your choosing
+# You can then use this throughout the rest of your script - Streamlit handles the rest
+# Loading and aggregating both happen in this one (cached) step, so after the first run there's
+# no separate aggregate stage to time
+with timed_stage("load"):
+    sports, events_per_year_by_sport, year_range = get_events_per_year_by_sport(
+        dataset_fingerprint(ATHLETE_DATA_PATH)
+        )
+
+selected_sport = st.selectbox("Select a sport", sports)
+
+with timed_stage("filter"):
+    events_per_year_selected_sport = events_per_year_by_sport[selected_sport]
+
+with timed_stage("chart"):
+    st.plotly_chart(
+        px.line(events_per_year_selected_sport,
+                x="Year", y="count",
+                markers=True,
+                title=f"{selected_sport} Events Per Olympics",
+                range_x=year_range)
+    )
 
 st.dataframe(
-    events_per_year_by_sport
+    events_per_year_selected_sport
 )
+
+# Show the timings for this rerun in the sidebar, along with how much memory the cached datasets
+# are using
+show_instrumentation_panel("app_with_caching")
+
+with st.sidebar:
+    with st.expander("Cached datasets"):
+        st.dataframe(dataset_memory_report(), hide_index=True)
@@ -2,8 +2,13 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 
+from cache_instrumentation import show_instrumentation_panel, start_rerun, timed_stage
+
 st.set_page_config(layout="wide")
 
+# Start timing this rerun - the results are shown in the sidebar (see cache_instrumentation.py)
+start_rerun()
+
 st.title("Caching Example - Without Caching (for speed/responsiveness comparison)")
 
 st.write(
@@ -13,6 +18,9 @@ st.write(
     that the example *with* caching is a bit more responsive - the new graph will appear a bit
     quicker and you don't see the 'loading' message appearing at the top of the screen
     quite so much.
+
+    Open 'Performance measurements' in the sidebar to see how long each part of the app takes,
+    and compare it with the version with caching.
     """
 )
 
@@ -23,30 +31,37 @@ st.write(
 # - The dataset will be loaded in separately for every single user, which can cause you
 #   to start exceeding memory limits on your hosting if you have lots of
 #   simultaneous users
-athlete_statistics = pd.read_csv("athlete_details_eventwise.csv")
+with timed_stage("load"):
+    athlete_statistics = pd.read_csv("athlete_details_eventwise.csv")
 
 
 # The code that follows
 selected_sport = st.selectbox("Select a sport",
                               athlete_statistics["Sport"].drop_duplicates().tolist())
 
-athlete_statistics_sport = athlete_statistics[athlete_statistics["Sport"] == selected_sport]
+with timed_stage("filter"):
+    athlete_statistics_sport = athlete_statistics[athlete_statistics["Sport"] == selected_sport]
 
-events_per_year_by_sport = (
-    athlete_statistics_sport[['Year', 'Event']]
-    .drop_duplicates()
-    .value_counts(['Year'])
-    .reset_index()
-)
+with timed_stage("aggregate"):
+    events_per_year_by_sport = (
+        athlete_statistics_sport[['Year', 'Event']]
+        .drop_duplicates()
+        .value_counts(['Year'])
+        .reset_index()
+    )
 
-st.plotly_chart(
-    px.line(events_per_year_by_sport.sort_values("Year"),
-            x="Year", y="count",
-            markers=True,
-            title=f"{selected_sport} Events Per Olympics",
-            range_x=[athlete_statistics.Year.min(), athlete_statistics.Year.max()])
-)
+with timed_stage("chart"):
+    st.plotly_chart(
+        px.line(events_per_year_by_sport.sort_values("Year"),
+                x="Year", y="count",
+                markers=True,
+                title=f"{selected_sport} Events Per Olympics",
+                range_x=[athlete_statistics.Year.min(), athlete_statistics.Year.max()])
+    )
 
 st.dataframe(
     events_per_year_by_sport
 )
+
+# Show the timings for this rerun in the sidebar
+show_instrumentation_panel("app_without_caching")
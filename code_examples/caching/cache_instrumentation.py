@@ -0,0 +1,178 @@
+import functools
+import json
+import pickle
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+# This file lets us measure what caching actually does for an app, rather than guessing.
+# It's used by both app_without_caching.py and app_with_caching.py so the two can be compared.
+#
+# It records three things:
+# 1. How long each stage of the script takes on every rerun (loading the data, filtering it,
+#    aggregating it and building the chart). Wrap each stage in 'with timed_stage("name"):'
+# 2. For each cached function, how many times it was called and how many of those calls actually
+#    had to run the function (a cache 'miss') rather than using the stored result (a 'hit')
+# 3. How big each cached object is in memory
+#
+# These are shown in a panel in the sidebar by calling show_instrumentation_panel() at the very
+# end of the script, and can also be saved to a file (one line of JSON per rerun) to compare
+# later on.
+
+# The file the timings get saved to if the user turns logging on
+LOG_PATH = "cache_timings.jsonl"
+
+# How many of the previous reruns to show in the panel
+RERUN_HISTORY_LENGTH = 10
+
+# The cache counts are shared by everyone using the app, just like the cache itself, so they are
+# stored here rather than in session state
+_cache_calls = Counter()
+_cache_misses = Counter()
+_cached_object_sizes = {}
+
+
+# Work out roughly how much memory an object is using, in bytes
+# Dataframes can tell us this themselves (deep=True includes the text in each cell). For a
+# dictionary or list we add up what's in it, and for anything else we see how big it is when
+# pickled - which is also how Streamlit stores things in @st.cache_data.
+def estimate_size(obj):
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(estimate_size(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(estimate_size(value) for value in obj)
+    try:
+        return len(pickle.dumps(obj))
+    except Exception:
+        return sys.getsizeof(obj)
+
+
+# Use this instead of @st.cache_data or @st.cache_resource to also count hits and misses, e.g.
+#
+#   @instrumented_cache(st.cache_data)
+#   def load_data():
+#       ...
+#
+# The call is counted *outside* the cached function (so every call is counted), and the miss is
+# counted *inside* it (so it's only counted when Streamlit actually has to run the function).
+def instrumented_cache(cache_decorator):
+    def decorate(function):
+        name = function.__name__
+
+        @functools.wraps(function)
+        def run_on_cache_miss(*args, **kwargs):
+            _cache_misses[name] += 1
+            result = function(*args, **kwargs)
+            _cached_object_sizes[name] = estimate_size(result)
+            return result
+
+        cached_function = cache_decorator(run_on_cache_miss)
+
+        @functools.wraps(function)
+        def count_call(*args, **kwargs):
+            _cache_calls[name] += 1
+            return cached_function(*args, **kwargs)
+
+        count_call.clear = cached_function.clear
+        return count_call
+
+    return decorate
+
+
+# Call this at the very top of the script to start timing a new rerun
+def start_rerun():
+    st.session_state.stage_timings = {}
+    st.session_state.rerun_start_time = time.perf_counter()
+    if "rerun_history" not in st.session_state:
+        st.session_state.rerun_history = []
+
+
+# Time one stage of the script, e.g.
+#
+#   with timed_stage("load"):
+#       athlete_statistics = load_data()
+@contextmanager
+def timed_stage(stage_name):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        st.session_state.stage_timings[stage_name] = (
+            st.session_state.stage_timings.get(stage_name, 0.0)
+            + time.perf_counter() - start_time
+        )
+
+
+# Get the cache counts and sizes as a table
+def cache_summary():
+    return pd.DataFrame(
+        [
+            {
+                "Cached function": name,
+                "Calls": _cache_calls[name],
+                "Hits": _cache_calls[name] - _cache_misses[name],
+                "Misses": _cache_misses[name],
+                "Cached size (MB)": _cached_object_sizes.get(name, 0) / (1024 * 1024),
+            }
+            for name in sorted(_cache_calls)
+        ],
+        columns=["Cached function", "Calls", "Hits", "Misses", "Cached size (MB)"]
+    )
+
+
+# Save the timings for this rerun as one line of JSON at the end of the log file
+def log_rerun(app_name, stage_timings, total_time, log_path=LOG_PATH):
+    record = {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "app": app_name,
+        "total_seconds": total_time,
+        "stage_seconds": stage_timings,
+        "cache": cache_summary().to_dict(orient="records"),
+    }
+    with open(log_path, "a") as log_file:
+        log_file.write(json.dumps(record) + "\n")
+
+
+# Call this at the very end of the script to show the timings in the sidebar (and save them to
+# the log file if the user has asked for that)
+def show_instrumentation_panel(app_name):
+    total_time = time.perf_counter() - st.session_state.rerun_start_time
+    stage_timings = dict(st.session_state.stage_timings)
+
+    st.session_state.rerun_history = (
+        st.session_state.rerun_history
+        + [{"Rerun total (ms)": total_time * 1000,
+            **{f"{stage} (ms)": seconds * 1000 for stage, seconds in stage_timings.items()}}]
+    )[-RERUN_HISTORY_LENGTH:]
+
+    with st.sidebar:
+        with st.expander("Performance measurements", expanded=True):
+            st.write(f"This rerun took **{total_time * 1000:.0f} ms**")
+
+            st.dataframe(
+                pd.DataFrame({
+                    "Stage": list(stage_timings.keys()),
+                    "Time (ms)": [seconds * 1000 for seconds in stage_timings.values()],
+                }),
+                hide_index=True
+            )
+
+            st.write("Cache hits and misses (for everyone using the app)")
+            cache_table = cache_summary()
+            if len(cache_table) == 0:
+                st.write("This app doesn't use any cached functions")
+            else:
+                st.dataframe(cache_table, hide_index=True)
+
+            st.write(f"Last {RERUN_HISTORY_LENGTH} reruns")
+            st.dataframe(pd.DataFrame(st.session_state.rerun_history))
+
+            if st.checkbox(f"Save timings to {LOG_PATH}", key="log_cache_timings"):
+                log_rerun(app_name, stage_timings, total_time)
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+import pandas as pd
+import streamlit as st
+
+# This file contains a ready-made, cached way of loading datasets for our apps.
+#
+# Putting @st.cache_data on a function that loads a file (as in app_with_caching.py) works well,
+# but has a few gaps:
+# - if the file changes while the app is running, the app keeps using the old copy until it is
+#   restarted or the cache is cleared
+# - the cache keeps every version of the file it has ever loaded, so the number of copies held in
+#   memory can creep up over time
+# - it's hard to see how much memory each cached dataset is using
+#
+# load_dataset() below fills those gaps:
+# - it checks whether the file has changed on every rerun (using its modification time, or a
+#   hash of its contents) and loads it again if it has
+# - it only keeps MAX_CACHED_DATASETS datasets, and throws them away after CACHE_TTL_SECONDS
+#   (which matters for data loaded from a web address, where we can't check for changes)
+#   Note this limits the number of datasets, not how much memory they use - one very large dataset
+#   still counts as one, so use dataset_memory_report() to keep an eye on memory
+# - it can save a Parquet copy of the file (a 'sidecar' file) the first time it's loaded, which is
+#   much quicker to read next time than a CSV or GeoJSON file
+# - dataset_memory_report() gives a table of how much memory each dataset is using
+#
+# Usage:
+#
+#   from cached_loader import load_dataset
+#   athlete_statistics = load_dataset("athlete_details_eventwise.csv", parquet_sidecar=True)
+#
+# Any extra arguments are passed on to the function that reads the file, e.g. pd.read_csv.
+#
+# This file is self-contained, so to use it in another app just copy it into that app's folder.
+
+# The most datasets to keep in the cache at once - the least recently used is thrown away first
+# (this is a count of datasets, not a limit on how much memory they use)
+MAX_CACHED_DATASETS = 8
+
+# How long to keep a dataset before loading it again anyway (in seconds)
+CACHE_TTL_SECONDS = 60 * 60
+
+# Files with these endings are read with geopandas rather than pandas
+GEO_SUFFIXES = (".geojson", ".gpkg", ".shp")
+
+# What we know about each dataset that has been loaded, for dataset_memory_report()
+_dataset_info = {}
+
+# The most files to remember the content hash of (see _content_hashes below)
+MAX_HASHED_FILES = 64
+
+# Hashes of file contents we've already worked out, so we only need to read the whole file again
+# when its modification time or size changes
+# This is keyed by the file's path and only holds the latest version of each file, with the
+# least recently used file forgotten once there are more than MAX_HASHED_FILES - so it can't keep
+# growing in an app that runs for a long time
+_content_hashes = OrderedDict()
+
+
+# Check whether a source is a file on this computer (rather than e.g. a web address)
+def is_local_file(source):
+    return "://" not in str(source) and os.path.exists(source)
+
+
+# Work out a 'fingerprint' of a file that changes whenever the file does
+# invalidate_on="mtime" uses the time the file was last changed and its size - very quick, but a
+# file that's been saved again without any changes counts as changed.
+# invalidate_on="hash" uses a hash of the file's contents - slower the first time, but only counts
+# genuine changes.
+# Anything that isn't a local file (e.g. a web address) gets None, so only the TTL applies.
+def dataset_fingerprint(source, invalidate_on="mtime"):
+    if not is_local_file(source):
+        return None
+
+    stat = os.stat(source)
+    file_version = (stat.st_mtime_ns, stat.st_size)
+
+    if invalidate_on == "mtime":
+        return file_version
+    if invalidate_on == "hash":
+        path = os.path.abspath(source)
+        if path in _content_hashes and _content_hashes[path][0] == file_version:
+            _content_hashes.move_to_end(path)
+        else:
+            with open(source, "rb") as f:
+                _content_hashes[path] = (file_version, hashlib.file_digest(f, "sha256").hexdigest())
+            _content_hashes.move_to_end(path)
+            while len(_content_hashes) > MAX_HASHED_FILES:
+                _content_hashes.popitem(last=False)
+        return _content_hashes[path][1]
+
+    raise ValueError(f"invalidate_on must be 'mtime' or 'hash', not '{invalidate_on}'")
+
+
+# The name of the Parquet copy of a file, e.g. athlete_details_eventwise.parquet
+# If any options were used to read the file (e.g. dtype={"Sport": "category"}), we add a short
+# hash of them to the name, so reading the file with different options makes a separate copy
+def parquet_sidecar_path(source, read_kwargs=None):
+    source = Path(source)
+    if not read_kwargs:
+        return source.with_suffix(".parquet")
+    options_hash = hashlib.sha256(
+        json.dumps(read_kwargs, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()[:8]
+    return source.with_suffix(f".{options_hash}.parquet")
+
+
+# Read a file with pandas (or geopandas for map files), working out how from the file ending
+def read_source(source, **read_kwargs):
+    suffix = Path(str(source)).suffix.lower()
+
+    if suffix in GEO_SUFFIXES:
+        # geopandas is only needed for map files, so we only import it here
+        try:
+            import geopandas
+        except ImportError as error:
+            raise ImportError(
+                f"Reading {suffix} files needs geopandas - install it with 'pip install geopandas'"
+            ) from error
+        return geopandas.read_file(source, **read_kwargs)
+    if suffix == ".parquet":
+        return pd.read_parquet(source, **read_kwargs)
+    if suffix == ".json":
+        return pd.read_json(source, **read_kwargs)
+    if suffix in (".xlsx", ".xls"):
+        return pd.read_excel(source, **read_kwargs)
+    return pd.read_csv(source, **read_kwargs)
+
+
+# Read a dataset, using (or creating) its Parquet sidecar file if parquet_sidecar is True
+def read_dataset(source, parquet_sidecar=False, **read_kwargs):
+    if not parquet_sidecar or not is_local_file(source):
+        return read_source(source, **read_kwargs)
+
+    sidecar = parquet_sidecar_path(source, read_kwargs)
+    is_geo = Path(source).suffix.lower() in GEO_SUFFIXES
+
+    # Use the sidecar if it was made after the source file was last changed
+    if sidecar.exists() and os.path.getmtime(sidecar) >= os.path.getmtime(source):
+        if is_geo:
+            import geopandas
+            return geopandas.read_parquet(sidecar)
+        return pd.read_parquet(sidecar)
+
+    data = read_source(source, **read_kwargs)
+
+    # Write to a temporary file first and then rename it, so a half-written file is never used.
+    # If we can't write the file (e.g. the folder is read-only, or pyarrow isn't installed) we
+    # just carry on without it.
+    temp_sidecar = sidecar.with_name(sidecar.name + ".tmp")
+    try:
+        data.to_parquet(temp_sidecar, index=False)
+        os.replace(temp_sidecar, sidecar)
+    except (OSError, ImportError):
+        if temp_sidecar.exists():
+            temp_sidecar.unlink()
+
+    return data
+
+
+# Work out roughly how much memory a dataset is using, in bytes
+def dataset_memory(data):
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        return int(data.memory_usage(deep=True).sum())
+    return 0
+
+
+# The fingerprint is one of the arguments, so when the file changes Streamlit sees a new set of
+# arguments and loads the file again. The old version stays in the cache until it's pushed out
+# by max_entries or expires through ttl.
+@st.cache_data(max_entries=MAX_CACHED_DATASETS, ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def _load_dataset_version(source, fingerprint, parquet_sidecar, read_kwargs):
+    data = read_dataset(source, parquet_sidecar, **read_kwargs)
+
+    _dataset_info[str(source)] = {
+        "Dataset": str(source),
+        "Rows": len(data),
+        "Columns": len(data.columns),
+        "Memory (MB)": dataset_memory(data) / (1024 * 1024),
+        "Version": str(fingerprint),
+    }
+
+    return data
+
+
+# Load a dataset through the cache, loading it again if the file has changed
+# source - a file path or web address
+# invalidate_on - "mtime" or "hash" (see dataset_fingerprint)
+# parquet_sidecar - save and reuse a quicker-to-load Parquet copy of the file
+# Any other arguments are passed on to the function that reads the file
+def load_dataset(source, invalidate_on="mtime", parquet_sidecar=False, **read_kwargs):
+    return _load_dataset_version(
+        source, dataset_fingerprint(source, invalidate_on), parquet_sidecar, read_kwargs
+    )
+
+
+# A table of the datasets that have been loaded and how much memory each one is using
+# This shows the most recent version of each dataset loaded by this app
+def dataset_memory_report():
+    return pd.DataFrame(
+        list(_dataset_info.values()),
+        columns=["Dataset", "Rows", "Columns", "Memory (MB)", "Version"]
+    )
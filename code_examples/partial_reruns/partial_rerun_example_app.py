@@ -1,14 +1,26 @@
 import streamlit as st
-from palmerpenguins import load_penguins
 import plotly.express as px
 import time
 
+from fragment_profiler import profile, show_performance_panel, start_page_run
+from penguin_data import (AXIS_COLUMNS, COLOUR_COLUMNS, get_penguin_columns,
+                          get_sex_counts_by_species, make_scatterplot)
+
+# Tell the profiler the whole page is running - see fragment_profiler.py
+# Anything that runs after this until show_performance_panel() at the bottom is part of a full
+# page run; anything that runs at any other time is a fragment rerunning by itself
+start_page_run()
+
 st.title("Example *With* Partial Reruns/@st.fragment")
 
 # Let's load in our penguins dataframe. Here, it's a dataset that's actually loaded in directly
 # from a function in a package, but everything in this example would be the same regardless of
 # where your dataset is coming from.
-penguins = load_penguins()
+# The loading happens in penguin_data.py, where the data is loaded once and cached, along with
+# the counts and columns the charts need - so the fragments below only have to pick out the
+# right data and draw the chart each time they rerun.
+sex_counts_by_species = get_sex_counts_by_species()
+penguin_columns = get_penguin_columns()
 
 # Let's set up two columns for our inputs and outputs to be placed within.
 app_column_1, app_column_2 = st.columns(2)
@@ -21,41 +33,62 @@ app_column_1, app_column_2 = st.columns(2)
 # Here, we’ve counted the select dropdown for species, the pandas dataframe filter action,
 # and the creation of the barplot figure as being a single thing we want to rerun
 # when any element within those three changes in a way that would trigger a rerun usually.
+#
+# Underneath @st.fragment we've also added @profile() (from fragment_profiler.py). This times every
+# run of the fragment, so we can see in the performance panel at the bottom of the page how much
+# quicker a fragment rerun is than a full page run. It needs to go *below* @st.fragment so it
+# times each rerun of the fragment.
+# We've given each input a key= so the profiler can work out which one triggered each rerun.
 @st.fragment
+@profile()
 def penguin_barchart():
     # This just pauses the app to make the effect of the use of @st.fragment a bit more obvious
     # You don't need to use this in your own apps!
     time.sleep(3)
     # Within this function we define our input - here a selection dropdown of three penguin species
-    species = st.selectbox("Select a penguin species to filter by", ["Adelie", "Gentoo", "Chinstrap"])
-    # We then make a new dataframe by filtering out our existing dataframes
-    filtered_df_species = penguins[penguins['species'] == species]
+    species = st.selectbox("Select a penguin species to filter by", ["Adelie", "Gentoo", "Chinstrap"],
+                           key="species")
+    # We then look up the counts of each sex for that species, which have already been worked out
     # Finally we make our plotly chart and wrap it in the st.plotly_chart() function to make sure it
     # will be displayed in the app
-    st.plotly_chart(px.bar(filtered_df_species['sex'].value_counts(), y='count'))
+    st.plotly_chart(px.bar(sex_counts_by_species[species], y='count'))
     # Notice how we don't *return* anything from this function - we just write everything like normal
     # streamlit code that just happens to be indented by one level!
 
 # We then repeat this for our next function.
 @st.fragment
+@profile()
 def penguin_scatterplot():
-    axis_options = ['bill_length_mm', 'bill_depth_mm',
-       'flipper_length_mm', 'body_mass_g']
+    axis_options = list(AXIS_COLUMNS)
     time.sleep(3)
-    col_1 = st.selectbox("Select the column to use for the x axis", axis_options)
+    col_1 = st.selectbox("Select the column to use for the x axis", axis_options, key="x_axis")
     axis_options.remove(col_1)
 
-    col_2 = st.selectbox("Select the column to use for the y axis", axis_options)
+    col_2 = st.selectbox("Select the column to use for the y axis", axis_options, key="y_axis")
 
-    color_factor = st.selectbox("Select the column to colour the chart by",
-    ["species", "sex", "island"])
+    color_factor = st.selectbox("Select the column to colour the chart by", COLOUR_COLUMNS,
+                                key="colour_by")
 
-    fig = px.scatter(
-        penguins,
-        x=col_1,
-        y=col_2,
-        color=color_factor,
-        title=f"Penguins Dataset - {col_1} vs {col_2}, coloured by {color_factor}")
+    # In 'figure-update mode', we don't build the chart from scratch every time. Instead we keep a
+    # ready-made chart for each colour column in the cache, and just swap in the values for the
+    # new axes (see make_scatterplot in penguin_data.py). This makes much more of a difference
+    # with bigger datasets than the penguins one!
+    # Turn it off to compare - the performance panel at the bottom shows how long each takes.
+    figure_update_mode = st.toggle("Figure-update mode", value=True, key="figure_update_mode")
+
+    if figure_update_mode:
+        fig = make_scatterplot(col_1, col_2, color_factor)
+    else:
+        # We only pass in the three columns the chart actually uses
+        # render_mode="webgl" draws the points using the graphics card, which keeps the chart
+        # responsive when there are lots of points
+        fig = px.scatter(
+            x=penguin_columns[col_1],
+            y=penguin_columns[col_2],
+            color=penguin_columns[color_factor],
+            labels={"x": col_1, "y": col_2, "color": color_factor},
+            title=f"Penguins Dataset - {col_1} vs {col_2}, coloured by {color_factor}",
+            render_mode="webgl")
 
     st.plotly_chart(fig)
 
@@ -71,3 +104,8 @@ with app_column_1:
 # We then repeat this for the second column and second function.
 with app_column_2:
    penguin_scatterplot()
+
+# Finally, show how long each fragment and cached function has taken, in a collapsible panel
+# Try changing one of the dropdowns - only the fragment it's in should show a new run
+show_performance_panel()
+
@@ -0,0 +1,120 @@
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+import streamlit as st
+from palmerpenguins import load_penguins
+
+from fragment_profiler import profile
+
+# This file contains the cached functions that load the penguins dataset and do the calculations
+# for the charts. Both partial_rerun_example_app.py and without_partial_rerun.py use them.
+#
+# Calling load_penguins() at the top of the app means the dataset is read in again on every
+# rerun, and counting the penguins of each sex every time the species dropdown changes means
+# doing the same calculation over and over. Instead, we load the data and work out everything the
+# charts need just once - so each rerun of a fragment only has to pick out the right bit of data
+# and draw the chart.
+#
+# As these functions are in their own file, both apps share the same cache - so whichever app you
+# open first does the work, and the other one gets the stored results.
+#
+# @profile() times every call to these functions, so the performance panel at the bottom of each
+# app shows how quick it is to get the results back from the cache (see fragment_profiler.py).
+# It goes above the caching decorator, so it times each call whether or not the cache is used.
+
+# The columns that can go on the axes of the scatterplot, and the ones it can be coloured by
+AXIS_COLUMNS = ['bill_length_mm', 'bill_depth_mm', 'flipper_length_mm', 'body_mass_g']
+COLOUR_COLUMNS = ['species', 'sex', 'island']
+
+
+# Load the penguins dataset once and keep it in the cache
+@profile()
+@st.cache_data
+def load_penguin_data():
+    return load_penguins()
+
+
+# Count the penguins of each sex for every species in one go, and store them in a dictionary
+# of species -> counts. Changing the species in the bar chart is then just a dictionary lookup.
+# We use @st.cache_resource as we never change these counts - this means Streamlit can hand back
+# the stored dictionary directly rather than making a copy of it on every rerun.
+@profile()
+@st.cache_resource
+def get_sex_counts_by_species():
+    penguins = load_penguin_data()
+
+    sex_counts = penguins.groupby('species')['sex'].value_counts()
+
+    return {species: sex_counts.loc[species] for species in penguins['species'].unique()}
+
+
+# Store each of the columns the scatterplot uses as a plain numpy array, so the chart can be
+# built from just the columns it needs rather than from the whole dataframe
+@profile()
+@st.cache_resource
+def get_penguin_columns():
+    penguins = load_penguin_data()
+
+    return {column: penguins[column].to_numpy() for column in AXIS_COLUMNS + COLOUR_COLUMNS}
+
+
+# A 'base' scatterplot for each column the chart can be coloured by, kept in the cache.
+#
+# Building a chart with px.scatter means plotly has to split the whole dataset up into one set of
+# points (a 'trace') for each colour, and work out all the colours and the legend. None of that
+# depends on which columns are on the axes - only on the colour column. So we do it once for each
+# colour column, and when the axes change we just swap in the new x and y values (see
+# make_scatterplot below).
+#
+# To know which rows of the data belong to each trace, we pass each row's position in as
+# custom_data - px.scatter then splits those up along with everything else. We keep the positions
+# and then remove the x, y and custom_data values from the stored chart, so the copy we make of it
+# each time is small.
+#
+# render_mode="webgl" draws the points with the computer's graphics card, so the chart stays quick
+# to zoom and hover over even with lots of points.
+@profile()
+@st.cache_resource
+def get_base_scatterplot(color_factor):
+    penguin_columns = get_penguin_columns()
+
+    fig = px.scatter(
+        x=penguin_columns[AXIS_COLUMNS[0]],
+        y=penguin_columns[AXIS_COLUMNS[1]],
+        color=penguin_columns[color_factor],
+        custom_data=[np.arange(len(penguin_columns[color_factor]))],
+        labels={"color": color_factor},
+        render_mode="webgl")
+
+    trace_positions = []
+    for trace in fig.data:
+        trace_positions.append(np.asarray(trace.customdata)[:, 0].astype(int))
+        trace.update(x=None, y=None, customdata=None)
+
+    return fig, trace_positions
+
+
+# Make the scatterplot for a pair of axis columns by copying the base chart for the colour column
+# and filling in the x and y values for each trace
+def make_scatterplot(col_1, col_2, color_factor):
+    penguin_columns = get_penguin_columns()
+    base_fig, trace_positions = get_base_scatterplot(color_factor)
+
+    # We make a copy so we never change the chart stored in the cache
+    fig = go.Figure(base_fig)
+
+    for trace, positions in zip(fig.data, trace_positions):
+        trace.update(
+            x=penguin_columns[col_1][positions],
+            y=penguin_columns[col_2][positions],
+            hovertemplate=(f"{color_factor}={trace.name}<br>{col_1}=%{{x}}<br>{col_2}=%{{y}}"
+                           "<extra></extra>")
+        )
+
+    fig.update_layout(
+        title=f"Penguins Dataset - {col_1} vs {col_2}, coloured by {color_factor}",
+        xaxis_title=col_1,
+        yaxis_title=col_2
+    )
+
+    return fig
@@ -1,11 +1,19 @@
 import streamlit as st
-from palmerpenguins import load_penguins
 import plotly.express as px
 import time
 
+from fragment_profiler import show_performance_panel, start_page_run
+from penguin_data import (AXIS_COLUMNS, COLOUR_COLUMNS, get_penguin_columns,
+                          get_sex_counts_by_species)
+
+# Tell the profiler the whole page is running - see fragment_profiler.py
+start_page_run()
+
 st.title("Example Without Partial Reruns/no use of @st.fragment")
 
-penguins = load_penguins()
+# The data is loaded and summarised once and then cached (see penguin_data.py)
+sex_counts_by_species = get_sex_counts_by_species()
+penguin_columns = get_penguin_columns()
 
 app_column_1, app_column_2 = st.columns(2)
 
@@ -14,9 +22,9 @@ with app_column_1:
     # You don't need to use this in your own apps!
     time.sleep(3)
     # Put our inputs and outputs into the first column
-    species = st.selectbox("Select a penguin species to filter by", ["Adelie", "Gentoo", "Chinstrap"])
-    filtered_df_species = penguins[penguins['species'] == species]
-    st.plotly_chart(px.bar(filtered_df_species['sex'].value_counts(), y='count'))
+    species = st.selectbox("Select a penguin species to filter by", ["Adelie", "Gentoo", "Chinstrap"],
+                           key="species")
+    st.plotly_chart(px.bar(sex_counts_by_species[species], y='count'))
 
 with app_column_2:
     # Again, this just pauses the app to make the effect of the use of @st.fragment a bit more obvious
@@ -24,18 +32,23 @@ with app_column_2:
     time.sleep(3)
 
     # Here we put a second set of inputs and outputs into our app, this time in the second column
-    axis_options = ['bill_length_mm', 'bill_depth_mm',
-                    'flipper_length_mm', 'body_mass_g']
+    axis_options = list(AXIS_COLUMNS)
 
-    col_1 = st.selectbox("Select the column to use for the x axis", axis_options)
+    col_1 = st.selectbox("Select the column to use for the x axis", axis_options, key="x_axis")
     axis_options.remove(col_1)
 
-    col_2 = st.selectbox("Select the column to use for the y axis", axis_options)
+    col_2 = st.selectbox("Select the column to use for the y axis", axis_options, key="y_axis")
 
-    color_factor = st.selectbox("Select the column to colour the chart by",
-    ["species", "sex", "island"])
+    color_factor = st.selectbox("Select the column to colour the chart by", COLOUR_COLUMNS,
+                                key="colour_by")
 
-    fig = px.scatter(penguins, x=col_1, y=col_2, color=color_factor,
+    fig = px.scatter(x=penguin_columns[col_1], y=penguin_columns[col_2],
+    color=penguin_columns[color_factor],
+    labels={"x": col_1, "y": col_2, "color": color_factor},
     title=f"Penguins Dataset - {col_1} vs {col_2}, coloured by {color_factor}")
 
     st.plotly_chart(fig)
+
+# Show how many times the page has run and how long the cached functions took, so we can compare
+# against partial_rerun_example_app.py - here, every change reruns the whole page
+show_performance_panel()
@@ -0,0 +1,166 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from wordcloud import STOPWORDS
+
+from wordcloud_utils import count_words, layout_wordcloud, prepare_mask, render_wordcloud
+
+# This file makes a wordcloud for every text file in a folder, from the command line, without
+# needing to go through the Streamlit app. This is handy for making wordclouds for hundreds of
+# feedback files in one go.
+#
+# Every wordcloud uses the same settings, which can be given in a JSON config file, e.g.
+#
+#   {
+#       "background_color": "white",
+#       "colormap": "viridis",
+#       "min_font_size": 10,
+#       "contour_width": 2,
+#       "mask": "logo.png",
+#       "extra_stopwords": ["film", "movie"]
+#   }
+#
+# Anything you leave out uses the defaults in DEFAULT_CONFIG. Then run
+#
+#   python batch_wordclouds.py feedback_folder --config config.json --output-dir wordclouds
+#
+# and you'll get one png in the output folder for each .txt file, with the same name.
+
+DEFAULT_CONFIG = {
+    "background_color": "black",
+    "colormap": "viridis",
+    "min_font_size": 15,
+    "contour_width": 0,
+    "mask": None,
+    "extra_stopwords": [],
+}
+
+# The mask and stopwords are the same for every file, so rather than sending them along with every
+# file we give them to each worker process once when it starts up (see init_worker), and it keeps
+# them here.
+_worker_mask = None
+_worker_stopwords = None
+_worker_config = None
+
+
+# Read the config file (if there is one) and fill in anything missing with the defaults
+def load_config(path=None):
+    config = dict(DEFAULT_CONFIG)
+
+    if path is not None:
+        with open(path) as f:
+            user_config = json.load(f)
+
+        unknown_settings = set(user_config) - set(DEFAULT_CONFIG)
+        if unknown_settings:
+            raise ValueError(f"Unrecognised settings in {path}: {sorted(unknown_settings)}")
+
+        config.update(user_config)
+
+    return config
+
+
+# This runs once in each worker process when the pool starts
+def init_worker(mask, stopwords, config):
+    global _worker_mask, _worker_stopwords, _worker_config
+    _worker_mask = mask
+    _worker_stopwords = stopwords
+    _worker_config = config
+
+
+# Make the wordcloud for a single file - this is what each worker process does
+# It returns the file name, whether it worked (or the error if not), and how long it took
+def make_wordcloud_for_file(text_path, output_dir):
+    start_time = time.perf_counter()
+    text_path = Path(text_path)
+
+    try:
+        with open(text_path, "rb") as text_file:
+            frequencies = count_words(text_file, _worker_stopwords)
+
+        wordcloud = layout_wordcloud(frequencies, _worker_mask, _worker_config["min_font_size"])
+
+        image_bytes = render_wordcloud(
+            wordcloud,
+            background_color=_worker_config["background_color"],
+            colormap=_worker_config["colormap"],
+            contour_width=_worker_config["contour_width"]
+            )
+
+        with open(Path(output_dir) / f"{text_path.stem}.png", "wb") as image_file:
+            image_file.write(image_bytes)
+
+        error = None
+    except (OSError, ValueError) as e:
+        # e.g. the file can't be read, isn't valid text (a UnicodeDecodeError is a kind of
+        # ValueError), is empty, or only contains stopwords - we report it and carry on with the
+        # rest of the files rather than stopping the whole batch
+        error = f"{type(e).__name__}: {e}"
+
+    return text_path.name, error, time.perf_counter() - start_time
+
+
+# Make wordclouds for all of the text files across a pool of processes
+def run_batch(text_paths, output_dir, config, workers=None):
+    # Prepare the mask and stopwords once here, rather than in every worker
+    mask = None if config["mask"] is None else prepare_mask(config["mask"])
+    stopwords = set(STOPWORDS) | set(config["extra_stopwords"])
+
+    failures = []
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=init_worker,
+                             initargs=(mask, stopwords, config)) as executor:
+        futures = [
+            executor.submit(make_wordcloud_for_file, text_path, output_dir)
+            for text_path in text_paths
+        ]
+
+        for future in as_completed(futures):
+            name, error, duration = future.result()
+            if error is None:
+                print(f"  {name}: {duration:.1f} seconds")
+            else:
+                print(f"  {name}: skipped ({error})")
+                failures.append(name)
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Make a wordcloud for every text file in a folder")
+    parser.add_argument("input_dir", help="Folder of .txt files")
+    parser.add_argument("--config", default=None, help="Optional JSON file of wordcloud settings")
+    parser.add_argument("--output-dir", default="wordclouds")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of wordclouds to make at the same time")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+
+    text_paths = sorted(Path(args.input_dir).glob("*.txt"))
+    total_mb = sum(text_path.stat().st_size for text_path in text_paths) / (1024 * 1024)
+    print(f"Making {len(text_paths)} wordclouds ({total_mb:.1f} MB of text) "
+          f"using {args.workers} workers")
+
+    Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+
+    start_time = time.perf_counter()
+    failures = run_batch(text_paths, args.output_dir, config, args.workers)
+    run_time = time.perf_counter() - start_time
+
+    made = len(text_paths) - len(failures)
+    print(f"Made {made} wordclouds in {run_time:.1f} seconds "
+          f"({made / max(run_time, 1e-9):.2f} wordclouds per second, "
+          f"{total_mb / max(run_time, 1e-9):.2f} MB of text per second)")
+    if failures:
+        print(f"Skipped {len(failures)} files: {', '.join(sorted(failures))}")
+    print(f"Wordclouds written to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
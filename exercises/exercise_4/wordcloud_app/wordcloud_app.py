@@ -1,11 +1,11 @@
 import streamlit as st
 
-from wordcloud import WordCloud, STOPWORDS, ImageColorGenerator
-import string
-import numpy as np
-from io import StringIO
-import matplotlib.pyplot as plt
-from PIL import Image
+from wordcloud import STOPWORDS
+import hashlib
+
+# The functions that do the work of making the wordcloud are in wordcloud_utils.py, so that they
+# can also be used without Streamlit (e.g. by batch_wordclouds.py)
+from wordcloud_utils import count_words, layout_wordcloud, prepare_mask, render_wordcloud
 
 st.set_page_config(layout="wide")
 
@@ -14,53 +14,50 @@ st.title("HSMA Wordcloud Generator")
 with open("bttf_reviews.txt", "r") as f:
     sample_text = f.read()[:3000]
 
-def make_wordcloud_with_image_mask(
-        text_input,
-        filename="wordcloud.png",
-        mask_image=None,
-        **kwargs
-        ):
-    stopwords = set(STOPWORDS)
-    tokens = text_input.split()
-    punctuation_mapping_table = str.maketrans('', '', string.punctuation)
-    tokens_stripped_of_punctuation = [token.translate(punctuation_mapping_table)
-                                  for token in tokens]
-    lower_tokens = [token.lower() for token in tokens_stripped_of_punctuation]
-
-    joined_string = (" ").join(lower_tokens)
-
-    plt.figure(figsize=(30,40))
-    plt.axis("off")
-
-    if mask_image is not None:
-        mask_image_opened = Image.open(mask_image)
-        mask_array = np.array(mask_image_opened)
-
-        wordcloud = WordCloud(width=mask_array.shape[1],
-                    height=mask_array.shape[0],
-                    stopwords=stopwords,
-                    mask=mask_array,
-                    **kwargs).generate(joined_string)
-
-        plt.imshow(wordcloud, interpolation='bilinear')
-
-    else:
-        wordcloud = WordCloud(width=1800,
-                    height=1800,
-                    stopwords=stopwords,
-                    **kwargs).generate(joined_string)
-
-        plt.imshow(wordcloud)
-
-    plt.savefig(filename)
+# Work out a short 'fingerprint' of some text or a file, so it can be used in a cache key
+# Files are read a chunk at a time, then wound back to the start so they can be read again
+def make_hash(data):
+    if isinstance(data, str):
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    data.seek(0)
+    file_hash = hashlib.file_digest(data, "sha256").hexdigest()
+    data.seek(0)
+    return file_hash
+
+# We cache in two levels, so that each widget only redoes the work it actually affects.
+#
+# Level 1: the word frequencies, which only change when the text or stopwords change.
+# Arguments starting with an underscore aren't used by Streamlit to check the cache, so rather
+# than Streamlit hashing the (possibly very long) text on every rerun, we pass in our own hash of
+# it as text_hash and pass the text itself as _text_input.
+@st.cache_data(max_entries=20)
+def get_cached_word_frequencies(text_hash, _text_input, stopwords):
+    return count_words(_text_input, stopwords)
+
+# The shrunk-down mask (see prepare_mask in wordcloud_utils.py), stored by a hash of the image file
+# so the same image only needs preparing once
+@st.cache_data(max_entries=10)
+def get_cached_mask(mask_hash, _mask_image):
+    return prepare_mask(_mask_image)
+
+# Level 2: the layout, which only changes when the words, the mask or the font size change.
+# We use @st.cache_resource because we only ever colour in a copy of the cached wordcloud (see
+# render_wordcloud), so it doesn't need to be copied every time it's used.
+# Changing the colourmap, background colour or contour doesn't change the layout, so those all
+# reuse the cached layout and are almost instant.
+@st.cache_resource(max_entries=20)
+def get_cached_wordcloud_layout(text_hash, _text_input, stopwords, mask_hash, _mask_image,
+                                min_font_size):
+    frequencies = get_cached_word_frequencies(text_hash, _text_input, stopwords)
+    mask = None if mask_hash is None else get_cached_mask(mask_hash, _mask_image)
+    return layout_wordcloud(frequencies, mask, min_font_size)
 
 uploaded_text = st.file_uploader("Upload a text file here", ["txt"])
-# Convert uploaded text to a string and display
-if uploaded_text is not None:
-    # see docs
-    # https://docs.streamlit.io/develop/api-reference/widgets/st.file_uploader
-    stringio = StringIO(uploaded_text.getvalue().decode("utf-8"))
-    uploaded_text = stringio.read()
+# We don't turn the uploaded file into one big string here - it gets read a chunk at a time when
+# we count the words (see wordcloud_utils.py)
+# see docs
+# https://docs.streamlit.io/develop/api-reference/widgets/st.file_uploader
 
 entered_text = st.text_area(label="Or enter your text here", value=sample_text,
                          height=300)
@@ -86,7 +83,8 @@ st.info(
     """
     White in images will be counted as an area where the words in the image cannot be drawn.
 
-    If your image mask isn't working, check whether the white elements are pure white or not!
+    Very light colours (nearly white) and any transparent parts of the image are counted as white
+    too, so you don't need to make sure the background is pure white.
     """
 )
 
@@ -120,21 +118,28 @@ colourmaps =  ['Accent', 'Accent_r', 'Blues', 'Blues_r', 'BrBG', 'BrBG_r', 'BuGn
 colourmap_selected = st.selectbox("Choose a colourmap", colourmaps)
 
 if your_text is not None:
-    make_wordcloud_with_image_mask(
-        text_input=your_text,
-        mask_image=mask_image,
-        background_color = background_colour_selected,
-        colormap = colourmap_selected,
-        min_font_size=minimum_font_size,
+    wordcloud_layout = get_cached_wordcloud_layout(
+        text_hash=make_hash(your_text),
+        _text_input=your_text,
+        stopwords=tuple(sorted(STOPWORDS)),
+        mask_hash=None if mask_image is None else make_hash(mask_image),
+        _mask_image=mask_image,
+        min_font_size=minimum_font_size
+        )
+
+    wordcloud_png = render_wordcloud(
+        wordcloud_layout,
+        background_color=background_colour_selected,
+        colormap=colourmap_selected,
         contour_width=contour_width
         )
 
-    st.image("wordcloud.png", use_column_width=True)
+    # Both of these can use the png bytes directly - there's no need to read a file back in
+    st.image(wordcloud_png, use_column_width=True)
 
-    with open("wordcloud.png", "rb") as file:
-        btn = st.download_button(
-            label="Click Here to Download Your Word Cloud!",
-            data=file,
-            file_name="my_wordcloud.png",
-            mime="image/png",
-        )
+    btn = st.download_button(
+        label="Click Here to Download Your Word Cloud!",
+        data=wordcloud_png,
+        file_name="my_wordcloud.png",
+        mime="image/png",
+    )
@@ -0,0 +1,197 @@
+import copy
+import io
+import re
+import string
+from collections import Counter
+
+import numpy as np
+from PIL import Image
+from wordcloud import STOPWORDS, WordCloud
+
+# This file contains the functions that make the wordclouds for the wordcloud app (and the batch
+# version in batch_wordclouds.py). None of them use Streamlit, so they work anywhere.
+#
+# WordCloud.generate() needs the whole text as one string, and the app used to make several full
+# copies of it along the way (split into words, with punctuation removed, made lowercase, then
+# joined back together) before the wordcloud package split it up all over again. For a
+# multi-megabyte file of reviews, that's a lot of memory.
+#
+# Instead, we read the text a chunk at a time, tidy up each word as we go and add it straight to a
+# Counter (a dictionary of word -> number of times it appears). Only the current chunk and the
+# counts are ever held in memory, however big the file is. The counts can then be passed to
+# WordCloud.generate_from_frequencies().
+
+# How many characters of text to read at a time
+CHUNK_SIZE = 64 * 1024
+
+# Removes every punctuation character from a word
+PUNCTUATION_MAPPING_TABLE = str.maketrans('', '', string.punctuation)
+
+# The same pattern the wordcloud package uses to find words - a run of letters or numbers.
+# This also splits up words joined by characters that aren't in string.punctuation (like '—').
+WORD_PATTERN = re.compile(r"\w[\w']*")
+
+
+# Turn the text (either a string, or a file uploaded through streamlit) into a stream we can
+# read a chunk at a time
+def open_text_stream(text_input):
+    if isinstance(text_input, str):
+        return io.StringIO(text_input)
+
+    # Uploaded files are bytes, so we decode them as we read rather than all in one go
+    text_input.seek(0)
+    return io.TextIOWrapper(text_input, encoding="utf-8", errors="replace")
+
+
+# Read words from a text stream one chunk at a time
+def iter_words(text_stream, chunk_size=CHUNK_SIZE):
+    leftover = ""
+
+    while True:
+        chunk = text_stream.read(chunk_size)
+        if not chunk:
+            break
+
+        words = (leftover + chunk).split()
+
+        # If the chunk doesn't end with a space, the last word might carry on into the next
+        # chunk, so we hold on to it until we've read the rest of it
+        if words and not chunk[-1].isspace():
+            leftover = words.pop()
+        else:
+            leftover = ""
+
+        yield from words
+
+    if leftover:
+        yield leftover
+
+
+# Tidy up a single word (remove punctuation, make it lowercase) and split it into the parts the
+# wordcloud package counts as words. This usually gives back a single word, but can give none
+# (e.g. for '-') or more than one.
+def normalise_word(word):
+    return WORD_PATTERN.findall(word.translate(PUNCTUATION_MAPPING_TABLE).lower())
+
+
+# Merge plurals into their singular word (e.g. 'films' into 'film') if both appear, the same way
+# the wordcloud package does. Words ending in 'ss' (like 'class') are left alone.
+def merge_plurals(word_counts):
+    for word in list(word_counts):
+        if word.endswith("s") and not word.endswith("ss") and word[:-1] in word_counts:
+            word_counts[word[:-1]] += word_counts.pop(word)
+    return word_counts
+
+
+# Count how many times each word appears in the text
+# Stopwords (common words like 'the' and 'and') and numbers are left out.
+#
+# Note that unlike WordCloud.generate(), this doesn't look for common pairs of words (e.g.
+# 'back future') - doing that needs the whole list of words at once, which is exactly what we're
+# trying to avoid.
+def count_words(text_input, stopwords=STOPWORDS, chunk_size=CHUNK_SIZE):
+    stopwords = set(stopword.lower() for stopword in stopwords)
+    text_stream = open_text_stream(text_input)
+
+    word_counts = Counter()
+
+    for word in iter_words(text_stream, chunk_size):
+        for part in normalise_word(word):
+            if part not in stopwords and not part.isdigit():
+                word_counts[part] += 1
+
+    # A TextIOWrapper closes the uploaded file when it's finished with, which would stop us
+    # reading it again, so we 'detach' it from the file first
+    if isinstance(text_stream, io.TextIOWrapper):
+        text_stream.detach()
+
+    return merge_plurals(word_counts)
+
+
+# Mask images
+#
+# The wordcloud is drawn at the same size as the mask, so a 4000 x 4000 photo means working out
+# where to fit every word on a 16 million pixel canvas, which can take minutes. Instead we shrink
+# the mask down so its longest side is at most MASK_WORKING_SIZE pixels, work out the layout at
+# that size, and then draw the words back at the original size (WordCloud's 'scale' option).
+# The layout is just as good - the words are simply drawn bigger - but it's far quicker.
+MASK_WORKING_SIZE = 800
+
+# Photos and jpgs rarely have backgrounds that are perfectly white (255), so anything at least
+# this light is treated as white (where words can't go), and everything else as black
+MASK_WHITE_THRESHOLD = 240
+
+
+# Turn an uploaded image into a mask the wordcloud can use
+# Returns the mask (a 2D array where 255 means 'no words here' and 0 means 'words can go here')
+# and how much it was shrunk by, which is the scale to draw the wordcloud at
+def prepare_mask(mask_image, working_size=MASK_WORKING_SIZE, white_threshold=MASK_WHITE_THRESHOLD):
+    mask_image_opened = Image.open(mask_image)
+
+    # Treat any transparent parts of the image as white
+    if mask_image_opened.mode in ("RGBA", "LA", "P"):
+        mask_image_opened = mask_image_opened.convert("RGBA")
+        background = Image.new("RGBA", mask_image_opened.size, "white")
+        mask_image_opened = Image.alpha_composite(background, mask_image_opened)
+
+    # A single greyscale channel with one byte per pixel is all the mask needs - a quarter of the
+    # memory of a colour image with transparency
+    mask_image_opened = mask_image_opened.convert("L")
+
+    scale = max(mask_image_opened.size) / working_size
+    if scale > 1:
+        working_width = max(1, round(mask_image_opened.width / scale))
+        working_height = max(1, round(mask_image_opened.height / scale))
+        mask_image_opened = mask_image_opened.resize(
+            (working_width, working_height), Image.Resampling.BOX
+            )
+    else:
+        scale = 1.0
+
+    mask_array = np.where(np.asarray(mask_image_opened) >= white_threshold, 255, 0)
+
+    return mask_array.astype(np.uint8), scale
+
+
+# Work out where every word goes (the 'layout') - this is the slow part of making a wordcloud
+# mask is the (mask_array, scale) pair from prepare_mask above, or None.
+# The layout is worked out on the small mask, then drawn 'scale' times bigger so the final image
+# is the same size as the original mask image. The minimum font size is shrunk by the same
+# amount, so the smallest words still come out at the size the user picked.
+def layout_wordcloud(frequencies, mask=None, min_font_size=4, **kwargs):
+    if mask is not None:
+        mask_array, scale = mask
+
+        wordcloud = WordCloud(width=mask_array.shape[1],
+                    height=mask_array.shape[0],
+                    mask=mask_array,
+                    scale=scale,
+                    min_font_size=max(1, round(min_font_size / scale)),
+                    **kwargs)
+
+    else:
+        wordcloud = WordCloud(width=1800,
+                    height=1800,
+                    min_font_size=min_font_size,
+                    **kwargs)
+
+    return wordcloud.generate_from_frequencies(frequencies)
+
+
+# Colour in a wordcloud that has already been laid out, and return it as the bytes of a png image
+# Changing the colours doesn't move any of the words, so this is very quick.
+# We work on a copy of the wordcloud so that the original layout (which may be shared through the
+# cache) isn't changed.
+# We get the image straight from the wordcloud with to_image() and save it into a BytesIO object
+# (a 'file' that only exists in memory) rather than drawing it with matplotlib and saving it to
+# disk. This is quicker, and it means two people using the app at the same time can't overwrite
+# each other's wordcloud.png file.
+def render_wordcloud(wordcloud, background_color="black", colormap=None, contour_width=0):
+    wordcloud = copy.copy(wordcloud)
+    wordcloud.background_color = background_color
+    wordcloud.contour_width = contour_width
+    wordcloud.recolor(colormap=colormap)
+
+    image_buffer = io.BytesIO()
+    wordcloud.to_image().save(image_buffer, format="png")
+    return image_buffer.getvalue()
@@ -13,6 +13,17 @@ if 'walk_in_demand' not in st.session_state:
     st.session_state.walk_in_demand = 150
 if 'calls_demand' not in st.session_state:
     st.session_state.calls_demand = 50
+# The arrival profiles (expected arrivals in each hour of the day) are only set once the user
+# has chosen their regions on the lsoa_map page, so they start off empty
+if 'walk_in_profile' not in st.session_state:
+    st.session_state.walk_in_profile = None
+if 'calls_profile' not in st.session_state:
+    st.session_state.calls_profile = None
+# The same goes for the list of LSOAs the demand comes from (and how much demand each one has)
+if 'selected_lsoa_codes' not in st.session_state:
+    st.session_state.selected_lsoa_codes = None
+if 'selected_lsoa_weights' not in st.session_state:
+    st.session_state.selected_lsoa_weights = None
 
 # Notice that here I've put the lsoa_map in between the homepage and des pages as it makes more sense
 # for the user to go to the lsoa map (to choose their region for demand) rather than going to the
@@ -22,6 +33,7 @@ pg = st.navigation(
     [st.Page("homepage.py", title="Welcome!", icon=":material/add_circle:"),
      st.Page("lsoa_map.py", title="Set Up Demand", icon=":material/people:"),
      st.Page("des.py", title="Run Simulation", icon=":material/public:"),
+     st.Page("compare_scenarios.py", title="Compare Scenarios", icon=":material/compare_arrows:"),
      ]
      )
 
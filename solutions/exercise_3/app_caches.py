@@ -0,0 +1,27 @@
+import streamlit as st
+
+from result_store import ResultStore
+from trial_cache import TrialDiskCache
+
+# The stores of simulation results that are shared by every page of the app.
+# These used to live in des.py, but the 'Compare Scenarios' page uses them too - Streamlit keeps
+# a separate cache for each function, so both pages need to call the *same* function to get back
+# the same store.
+
+# @st.cache_resource means this function only runs once for the whole app - every user (session)
+# gets back exactly the same ResultStore object. This means if two planners run the same scenario
+# (like the default demand of 150 walk-ins and 50 calls), the second one gets the stored results
+# instead of waiting for the simulation to run again.
+# The store will use at most 256MB of memory, throwing away the least recently used results first.
+# If you want results to also be saved to disk, pass in a file path, e.g.
+# ResultStore(max_bytes=256 * 1024 * 1024, persist_path="trial_results.sqlite")
+@st.cache_resource
+def get_result_store():
+    return ResultStore(max_bytes=256 * 1024 * 1024)
+
+# Anything in the store above is lost when the Streamlit server restarts, so behind it we also keep
+# a cache of results on disk (in the 'trial_cache' folder). This can be filled up before anyone
+# opens the app by running 'python trial_cache.py warm' from the command line.
+@st.cache_resource
+def get_trial_disk_cache():
+    return TrialDiskCache(max_bytes=1024 * 1024 * 1024)
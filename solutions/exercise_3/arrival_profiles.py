@@ -0,0 +1,131 @@
+import numpy as np
+
+# This file contains the functions for arrivals that change through the day.
+#
+# The basic model assumes patients arrive at the same average rate all day (a constant
+# inter-arrival time). In reality, clinics tend to be busier at some times than others.
+# Here we describe demand with an 'hourly profile' - a list giving the expected number of arrivals
+# in each hour the clinic is open, e.g. [25, 20, 15, ...] - and then sample arrival times that
+# follow it. This is called a 'non-homogeneous Poisson process'.
+#
+# Rather than sampling one arrival at a time and rejecting some of them (a method called
+# 'thinning'), we sample all of the arrivals for the day in one go:
+#   1. Work out the running total of expected arrivals at the start of each hour
+#      (the 'cumulative rate').
+#   2. Sample arrivals from a process with one arrival per unit of time, up to the total expected
+#      arrivals for the day. This is easy to do all at once with numpy.
+#   3. Turn each of those back into a clock time by finding where that running total is reached -
+#      a quick lookup because the running total is a straight line within each hour.
+#
+# There's also a function for sampling all of the arrivals for a day with a constant
+# inter-arrival time in one go, used when g.pregenerate_arrivals is turned on (see des_classes.py).
+
+# How demand is spread across an 8 hour clinic day if it's busier in the morning
+# These are relative values - they get scaled so they add up to the daily demand
+MORNING_PEAK_SHAPE = [1.5, 1.4, 1.2, 1.0, 0.8, 0.8, 0.7, 0.6]
+
+# The same demand in every hour of an 8 hour clinic day
+FLAT_SHAPE = [1, 1, 1, 1, 1, 1, 1, 1]
+
+ARRIVAL_PATTERNS = {
+    "Even through the day": FLAT_SHAPE,
+    "Busier in the morning": MORNING_PEAK_SHAPE,
+}
+
+
+# Scale a shape (like MORNING_PEAK_SHAPE) so the hours add up to the daily demand
+def make_hourly_profile(daily_demand, shape=MORNING_PEAK_SHAPE):
+    shape = np.asarray(shape, dtype=float)
+    return (shape / shape.sum() * daily_demand).tolist()
+
+
+# Spread a profile over a clinic day of a different length, keeping the same overall pattern and
+# the same total demand.
+# For example, an 8 hour profile used for a 10 hour simulation is stretched so that the morning
+# peak still happens in the first part of the day. This matches how the constant inter-arrival
+# time is worked out in des.py (the daily demand spread over however long the clinic is open).
+# The values returned are arrivals per hour - if the last hour is only partly open, its value is
+# still a rate per full hour, so the expected total up to sim_duration is still the daily demand.
+def stretch_profile(hourly_profile, sim_duration):
+    hourly_profile = np.asarray(hourly_profile, dtype=float)
+
+    # Running total of demand at the end of each hour, as a fraction of the way through the day
+    day_fractions = np.linspace(0, 1, len(hourly_profile) + 1)
+    cumulative_demand = np.concatenate([[0.0], np.cumsum(hourly_profile)])
+
+    # The start and end of each hour of the new, longer or shorter, day
+    hour_starts = np.arange(0, sim_duration, 60.0)
+    hour_ends = np.minimum(hour_starts + 60, sim_duration)
+
+    demand_in_hour = (
+        np.interp(hour_ends / sim_duration, day_fractions, cumulative_demand)
+        - np.interp(hour_starts / sim_duration, day_fractions, cumulative_demand)
+    )
+
+    return (demand_in_hour / (hour_ends - hour_starts) * 60).tolist()
+
+
+# Sample every arrival time for a run from an hourly profile
+# hourly_profile - expected arrivals per hour for each hour of the simulation; if the simulation is
+#                  longer than the profile, the profile repeats
+# sim_duration - the length of the simulation in minutes
+# rng - a numpy random number generator
+# Returns a sorted numpy array of arrival times in minutes
+def sample_arrival_times(hourly_profile, sim_duration, rng):
+    hours_needed = int(np.ceil(sim_duration / 60))
+    rate_per_minute = np.resize(np.asarray(hourly_profile, dtype=float), hours_needed) / 60
+
+    # The running total of expected arrivals at the start of each hour, plus at the end of the
+    # simulation (which might be part way through an hour)
+    hour_starts = np.arange(hours_needed) * 60.0
+    hour_lengths = np.minimum(60.0, sim_duration - hour_starts)
+    cumulative_rate = np.concatenate([[0.0], np.cumsum(rate_per_minute * hour_lengths)])
+
+    total_expected = cumulative_rate[-1]
+    if total_expected <= 0:
+        return np.array([])
+
+    # A process with one arrival per unit of time: the number of arrivals is Poisson distributed,
+    # and given that number, the arrivals are spread uniformly at random
+    number_of_arrivals = rng.poisson(total_expected)
+    unit_arrivals = np.sort(rng.uniform(0, total_expected, number_of_arrivals))
+
+    # Find which hour each arrival falls in, then how far into the hour it is
+    hour = np.searchsorted(cumulative_rate, unit_arrivals, side="right") - 1
+    hour = np.clip(hour, 0, hours_needed - 1)
+
+    # Hours with no demand can't contain any arrivals, but we avoid dividing by zero just in case
+    rate_in_hour = rate_per_minute[hour]
+    minutes_into_hour = np.divide(
+        unit_arrivals - cumulative_rate[hour], rate_in_hour,
+        out=np.zeros_like(unit_arrivals), where=rate_in_hour > 0
+        )
+
+    return hour_starts[hour] + minutes_into_hour
+
+
+# Sample every arrival time for a run with a constant average inter-arrival time
+# This gives the same kind of arrivals as the loop in Model.generator_patient_arrivals (one arrival
+# at the start of the day, then exponentially distributed gaps), but draws all of the gaps in one
+# go with numpy and adds them up with a cumulative sum, rather than drawing them one at a time.
+# mean_inter_arrival_time - the average gap between arrivals in minutes
+# sim_duration - the length of the simulation in minutes
+# rng - a numpy random number generator
+# Returns a sorted numpy array of arrival times in minutes
+def sample_exponential_arrival_times(mean_inter_arrival_time, sim_duration, rng):
+    # Draw a few more gaps than we expect to need, so we nearly always only need to draw once.
+    # If the arrivals still don't reach the end of the simulation, we draw another batch.
+    expected_arrivals = sim_duration / mean_inter_arrival_time
+    batch_size = int(expected_arrivals + 4 * np.sqrt(expected_arrivals)) + 10
+
+    arrival_times = [np.zeros(1)]
+    last_arrival_time = 0.0
+    while last_arrival_time < sim_duration:
+        batch = last_arrival_time + np.cumsum(rng.exponential(mean_inter_arrival_time, batch_size))
+        arrival_times.append(batch)
+        last_arrival_time = batch[-1]
+
+    arrival_times = np.concatenate(arrival_times)
+
+    # Throw away anything after the end of the simulation
+    return arrival_times[:np.searchsorted(arrival_times, sim_duration)]
@@ -0,0 +1,178 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+from result_store import default_scenario_parameters, run_trial_with_parameters
+from trial_cache import TrialDiskCache, make_cache_key
+
+# This file lets you run lots of scenarios of the model from the command line, without needing to
+# go through the Streamlit app. This is handy for big overnight batches that would otherwise tie
+# up the web server.
+#
+# Scenarios are read from a YAML, JSON or CSV file. Each scenario has an optional 'name' and then
+# any of the parameters from the g class you want to change - anything you leave out keeps its
+# default value. For example, in YAML:
+#
+#   - name: Baseline
+#     random_seed: 42
+#   - name: Extra GP
+#     number_of_gps: 3
+#     random_seed: 42
+#
+# or as a CSV file:
+#
+#   name,number_of_gps,random_seed
+#   Baseline,2,42
+#   Extra GP,3,42
+#
+# Then run
+#
+#   python batch_runner.py scenarios.yaml --output-dir batch_results --workers 4
+#
+# and you'll get summary.parquet, callers.parquet and patients.parquet in the output folder,
+# each with a 'Scenario' column saying which scenario each row came from.
+
+# The default parameters from the g class
+# These come from the copy taken when des_classes.py was loaded (see result_store.py), rather than
+# from the g class itself - when this file is used from the app, other users may have changed it.
+# Each scenario starts from these defaults and then applies its own changes.
+DEFAULT_PARAMETERS = default_scenario_parameters()
+
+
+# Read the list of scenarios from a file, working out the format from the file extension
+def load_scenarios(path):
+    path = Path(path)
+    suffix = path.suffix.lower()
+
+    if suffix in (".yaml", ".yml"):
+        # PyYAML is only needed if you use YAML files, so we only import it here
+        try:
+            import yaml
+        except ImportError as error:
+            raise ImportError(
+                "Reading YAML scenario files needs PyYAML - install it with 'pip install pyyaml'"
+            ) from error
+        with open(path) as f:
+            scenarios = yaml.safe_load(f)
+    elif suffix == ".json":
+        with open(path) as f:
+            scenarios = json.load(f)
+    elif suffix == ".csv":
+        # Blank cells in the csv mean 'use the default', so we drop them from each scenario
+        scenarios = [
+            {name: value for name, value in row.items() if not pd.isna(value)}
+            for row in pd.read_csv(path).to_dict(orient="records")
+        ]
+    else:
+        raise ValueError(f"Unrecognised scenario file type '{suffix}' - use yaml, json or csv")
+
+    # Allow scenarios to either be a plain list, or listed under a 'scenarios' heading
+    if isinstance(scenarios, dict):
+        scenarios = scenarios.get("scenarios", [])
+
+    return [_tidy_scenario(scenario, number) for number, scenario in enumerate(scenarios, start=1)]
+
+
+# Give every scenario a name, check its parameters exist, and make sure whole numbers are stored
+# as integers (e.g. a csv column with some blanks will be read in as 3.0 rather than 3)
+def _tidy_scenario(scenario, number):
+    scenario = dict(scenario)
+    name = str(scenario.pop("name", f"Scenario {number}"))
+
+    for parameter, value in scenario.items():
+        if parameter not in DEFAULT_PARAMETERS:
+            raise ValueError(f"{name}: '{parameter}' is not a parameter of the g class")
+        if hasattr(value, "item"):
+            value = value.item()
+        if (isinstance(DEFAULT_PARAMETERS[parameter], int) or parameter == "random_seed") \
+                and isinstance(value, float) and value.is_integer():
+            value = int(value)
+        scenario[parameter] = value
+
+    return name, scenario
+
+
+# Run a single scenario - this is what each worker process does
+# It returns the scenario name, the three results dataframes and how long it took
+def run_scenario(name, scenario, cache_dir=None):
+    start_time = time.perf_counter()
+
+    parameters = {**DEFAULT_PARAMETERS, **scenario}
+
+    if cache_dir is None:
+        results = run_trial_with_parameters(parameters)
+    else:
+        cache = TrialDiskCache(cache_dir)
+        results = cache.get_or_run(
+            make_cache_key(parameters), lambda: run_trial_with_parameters(parameters)
+        )
+
+    return name, results, time.perf_counter() - start_time
+
+
+# Run all of the scenarios across a pool of processes and collect the results together
+def run_batch(scenarios, workers=None, cache_dir=None):
+    if not scenarios:
+        raise ValueError("There are no scenarios to run")
+
+    summary_dfs = []
+    caller_dfs = []
+    patient_dfs = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(run_scenario, name, scenario, cache_dir)
+            for name, scenario in scenarios
+        ]
+
+        for future in as_completed(futures):
+            name, (df_trial_results, caller_results, patient_results), duration = future.result()
+            print(f"  {name}: {duration:.1f} seconds")
+
+            for df, dfs in ((df_trial_results, summary_dfs),
+                            (caller_results, caller_dfs),
+                            (patient_results, patient_dfs)):
+                df = df.reset_index(drop=False)
+                df.insert(loc=0, column="Scenario", value=name)
+                dfs.append(df)
+
+    return pd.concat(summary_dfs), pd.concat(caller_dfs), pd.concat(patient_dfs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a batch of scenarios of the clinic model")
+    parser.add_argument("scenario_file", help="YAML, JSON or CSV file of scenarios")
+    parser.add_argument("--output-dir", default="batch_results")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of scenarios to run at the same time")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Optional folder to reuse and save results in (see trial_cache.py)")
+    args = parser.parse_args()
+
+    scenarios = load_scenarios(args.scenario_file)
+    if not scenarios:
+        parser.exit(1, f"No scenarios found in {args.scenario_file} - nothing to run\n")
+    print(f"Running {len(scenarios)} scenarios using {args.workers} workers")
+
+    start_time = time.perf_counter()
+    summary_df, callers_df, patients_df = run_batch(scenarios, args.workers, args.cache_dir)
+    run_time = time.perf_counter() - start_time
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    summary_df.to_parquet(output_dir / "summary.parquet", index=False)
+    callers_df.to_parquet(output_dir / "callers.parquet", index=False)
+    patients_df.to_parquet(output_dir / "patients.parquet", index=False)
+
+    print(f"Finished {len(scenarios)} scenarios in {run_time:.1f} seconds "
+          f"({run_time / max(len(scenarios), 1):.2f} seconds per scenario)")
+    print(f"Results written to {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import time
+
+import plotly.express as px
+import streamlit as st
+
+from app_caches import get_result_store, get_trial_disk_cache
+from batch_runner import DEFAULT_PARAMETERS
+from scenario_comparison import (paired_differences, paired_run_differences,
+                                 run_scenarios_concurrently)
+
+st.set_page_config(layout="wide")
+
+st.logo("hsma_logo.png")
+
+# Import custom css for using a Google font
+with open("style.css") as css:
+    st.markdown(f'<style>{css.read()}</style>', unsafe_allow_html=True)
+
+st.title("Compare Scenarios")
+
+st.write(
+    """
+    Set up two versions of the clinic and run them side by side. Both scenarios use the same
+    demand (from the 'Set Up Demand' page) and the same random numbers, so any difference in the
+    results comes from the changes you've made rather than from chance.
+    """
+)
+
+# These are the same shared stores of results used by the 'Run Simulation' page (see
+# app_caches.py) - so a scenario that's already been run on either page comes straight back
+result_store = get_result_store()
+trial_disk_cache = get_trial_disk_cache()
+
+# The settings that both scenarios share go in the sidebar
+with st.sidebar:
+    st.markdown("#### Shared Settings")
+    sim_duration_input = st.slider("Simulation Duration (minutes)", 60, 840, 480)
+    number_of_runs_input = st.slider("Number of Runs", 2, 100, 10)
+    # The seed must be fixed for the runs of the two scenarios to be paired up (along with
+    # pregenerate_arrivals - see shared_parameters below)
+    random_seed_input = st.number_input("Random Seed", 0, 1_000_000, 42)
+    confidence_input = st.selectbox("Confidence level", [0.9, 0.95, 0.99], index=1,
+                                    format_func=lambda level: f"{level:.0%}")
+
+    st.divider()
+    st.markdown("#### Demand")
+    st.write(f"Daily walk-in demand: {st.session_state.walk_in_demand:.0f} walk-in patients")
+    st.write(f"Daily call demand: {st.session_state.calls_demand:.0f} calls")
+    if st.session_state.walk_in_demand == 150 and st.session_state.calls_demand == 50:
+        st.warning("You are using the default values for demand - go to the 'Set Up Demand' "
+                   "page to choose your regions")
+
+
+# The inputs for one scenario
+# Each input needs its own key, as otherwise Streamlit would see the inputs for the two
+# scenarios as the same widget
+def scenario_inputs(key_prefix):
+    return {
+        "mean_reg_time": st.slider("Mean Registration Duration", 1, 20, 2,
+                                   key=f"{key_prefix}_reg_time"),
+        "mean_gp_time": st.slider("Mean GP Consultation Duration", 5, 45, 8,
+                                  key=f"{key_prefix}_gp_time"),
+        "mean_book_test_time": st.slider("Mean Test Booking Duration", 1, 10, 4,
+                                         key=f"{key_prefix}_book_test_time"),
+        "mean_call_time": st.slider("Mean Call Duration", 1, 30, 4,
+                                    key=f"{key_prefix}_call_time"),
+        "number_of_receptionists": st.slider("Number of Receptionists", 1, 8, 1,
+                                             key=f"{key_prefix}_receptionists"),
+        "number_of_gps": st.slider("Number of GPs", 1, 8, 2, key=f"{key_prefix}_gps"),
+        "prob_book_test": st.number_input("Probability of booking a test", 0.0, 1.0, 0.25,
+                                          key=f"{key_prefix}_prob_book_test"),
+    }
+
+
+column_a, column_b = st.columns(2)
+
+with column_a:
+    st.subheader("Scenario A")
+    scenario_a_inputs = scenario_inputs("a")
+
+with column_b:
+    st.subheader("Scenario B")
+    scenario_b_inputs = scenario_inputs("b")
+
+# Put together the full set of g class parameters for each scenario
+# Rather than changing the g class here (which is shared with everyone else using the app), we
+# pass the parameters to the processes that run each scenario
+shared_parameters = {
+    "patient_inter": sim_duration_input / st.session_state.walk_in_demand,
+    "call_inter": sim_duration_input / st.session_state.calls_demand,
+    "patient_arrival_profile": None,
+    "call_arrival_profile": None,
+    "lsoa_codes": None,
+    "lsoa_weights": None,
+    "sim_duration": sim_duration_input,
+    "number_of_runs": number_of_runs_input,
+    "random_seed": random_seed_input,
+    # Work out the arrivals before each run, and give everyone their own random numbers for their
+    # activity times, so run 1 of scenario A has the same patients arriving at the same times
+    # (and needing the same length of appointment) as run 1 of scenario B
+    "pregenerate_arrivals": True,
+}
+
+scenarios = {
+    "Scenario A": {**DEFAULT_PARAMETERS, **shared_parameters, **scenario_a_inputs},
+    "Scenario B": {**DEFAULT_PARAMETERS, **shared_parameters, **scenario_b_inputs},
+}
+
+if st.button("Run comparison"):
+    with st.spinner("Simulating both scenarios..."):
+        start_time = time.perf_counter()
+        results = run_scenarios_concurrently(scenarios, result_store, trial_disk_cache.cache_dir)
+        run_time = time.perf_counter() - start_time
+
+    st.caption(f"Both scenarios ready in {run_time:.1f} seconds (scenarios that have been run "
+               "before come straight from the cache)")
+
+    results_a = results["Scenario A"][0]
+    results_b = results["Scenario B"][0]
+
+    comparison_df = paired_differences(results_a, results_b, confidence_input)
+
+    st.subheader("Paired Differences")
+    st.write(
+        f"""
+        For each measure, this shows the average over the {number_of_runs_input} runs of
+        scenario B minus scenario A, with a {confidence_input:.0%} confidence interval. Where the
+        interval doesn't include 0, the change between the scenarios makes a clear difference.
+        """
+    )
+
+    st.dataframe(
+        comparison_df.style.format(precision=2),
+        hide_index=True
+    )
+
+    # Show the differences and their confidence intervals as a chart, with a line at 0
+    differences_fig = px.scatter(
+        comparison_df,
+        x="Mean Difference (B - A)",
+        y="Measure",
+        color="Clear Difference",
+        error_x=comparison_df["Upper CI"] - comparison_df["Mean Difference (B - A)"],
+        error_x_minus=comparison_df["Mean Difference (B - A)"] - comparison_df["Lower CI"],
+        title=f"Scenario B minus Scenario A ({confidence_input:.0%} confidence intervals)"
+    )
+    differences_fig.add_vline(x=0, line_dash="dash", line_color="grey")
+    st.plotly_chart(differences_fig)
+
+    with st.expander("Click here to see the difference for each run"):
+        st.dataframe(paired_run_differences(results_a, results_b).round(2))
@@ -4,7 +4,11 @@ import plotly.express as px
 import re
 import streamlit as st
 
-from des_classes import g, Trial
+from arrival_profiles import stretch_profile
+from origin_sampling import summarise_waits_by_origin
+from app_caches import get_result_store, get_trial_disk_cache
+from result_store import default_scenario_parameters, run_trial_with_parameters
+from trial_cache import make_cache_key
 
 st.set_page_config(layout="wide")
 
@@ -27,11 +31,26 @@ with open("style.css") as css:
 
 st.title("Clinic Simulation")
 
+# The shared stores of results live in app_caches.py, so the 'Compare Scenarios' page can use them
+# too. The first one is kept in memory and shared by every user; the second saves results to disk
+# so they survive the app being restarted.
+result_store = get_result_store()
+trial_disk_cache = get_trial_disk_cache()
+
 with st.sidebar:
     st.markdown("#### Simulation Parameters")
     sim_duration_input =  st.slider("Simulation Duration (minutes)", 60, 840, 480)
     st.write(f"The clinic is open for {sim_duration_input/60:.2f} hours")
     number_of_runs_input = st.slider("Number of Runs", 1, 100, 10)
+    # Using a fixed seed means the same inputs always give the same results, so they can be
+    # reused from the cache
+    random_seed_input = st.number_input("Random Seed", 0, 1_000_000, 42)
+    # Working out the arrivals in advance keeps them the same when other settings change (see
+    # pregenerate_arrivals in des_classes.py) - the 'Compare Scenarios' page always does this
+    pregenerate_arrivals_input = st.checkbox(
+        "Work out arrivals before each run starts",
+        value=False
+        )
 
     st.divider()
 
@@ -55,6 +74,27 @@ with st.sidebar:
 
     st.write(f"The inter-arrival time for calls is {call_inter_input:.1f} minutes")
 
+    # If the user has been to the demand page, we can use the hourly arrival profile from there
+    # instead of a constant inter-arrival time
+    profiles_available = st.session_state.walk_in_profile is not None
+    use_arrival_profile_input = st.checkbox(
+        "Vary arrivals through the day (using the pattern from the demand page)",
+        value=False,
+        disabled=not profiles_available
+        )
+
+    # Similarly, if we know which LSOAs the demand comes from, we can record which LSOA each
+    # patient and caller comes from and look at waits for each area
+    # (there must be at least one LSOA with some demand, or there's nothing to pick from)
+    origins_available = (st.session_state.selected_lsoa_codes is not None
+                         and len(st.session_state.selected_lsoa_codes) > 0
+                         and sum(st.session_state.selected_lsoa_weights) > 0)
+    record_origins_input = st.checkbox(
+        "Record which LSOA each patient and caller comes from",
+        value=False,
+        disabled=not origins_available
+        )
+
     st.divider()
     st.markdown("#### Activity Durations")
     mean_reg_time_input = st.slider("Mean Registration Duration", 1, 20, 2)
@@ -71,32 +111,65 @@ with st.sidebar:
     st.markdown("#### Branch Probabilities")
     prob_book_test_input = st.number_input("Probability of booking a test", 0.0, 1.0, 0.25)
 
+    st.divider()
+    with st.expander("Shared result store"):
+        result_store_stats = result_store.stats()
+        st.write(f"Scenarios stored: {result_store_stats['entries']}")
+        st.write(f"Memory used: {result_store_stats['memory_mb']:.1f} of "
+                 f"{result_store_stats['max_memory_mb']:.0f} MB")
+        st.write(f"Hits: {result_store_stats['hits']} | Misses: {result_store_stats['misses']} | "
+                 f"Evictions: {result_store_stats['evictions']}")
+        st.write(f"Scenarios saved to disk: {trial_disk_cache.stats()['entries']}")
+
+# Rather than changing the g class directly, we put this session's parameters together in a
+# dictionary. The g class is shared by everyone using the app, so if we changed it here, another
+# user could change it again before our trial ran - and their results would get stored under our
+# scenario's key. Instead, the same dictionary is used to work out the key and to run the trial
+# (see run_trial_with_parameters in result_store.py).
+# We start from the defaults in the g class and then change the values the user has set.
+scenario_parameters = default_scenario_parameters()
 
 # Inter-arrival times
 # Here we're passing in the inter-arrival time that we calculated from the input
-g.patient_inter = patient_inter_input
-g.call_inter = call_inter_input
+scenario_parameters["patient_inter"] = patient_inter_input
+scenario_parameters["call_inter"] = call_inter_input
+
+# Arrival profiles - these are stretched to fit however long the clinic is open for
+if use_arrival_profile_input and profiles_available:
+    scenario_parameters["patient_arrival_profile"] = stretch_profile(
+        st.session_state.walk_in_profile, sim_duration_input
+        )
+    scenario_parameters["call_arrival_profile"] = stretch_profile(
+        st.session_state.calls_profile, sim_duration_input
+        )
+
+# LSOAs that arrivals come from, weighted by their demand
+if record_origins_input and origins_available:
+    scenario_parameters["lsoa_codes"] = st.session_state.selected_lsoa_codes
+    scenario_parameters["lsoa_weights"] = st.session_state.selected_lsoa_weights
 
 # Activity times
-g.mean_reg_time = mean_reg_time_input
-g.mean_gp_time = mean_gp_time_input
-g.mean_book_test_time = mean_book_test_time_input
-g.mean_call_time = mean_call_time_input
+scenario_parameters["mean_reg_time"] = mean_reg_time_input
+scenario_parameters["mean_gp_time"] = mean_gp_time_input
+scenario_parameters["mean_book_test_time"] = mean_book_test_time_input
+scenario_parameters["mean_call_time"] = mean_call_time_input
 
 # Resource numbers
-g.number_of_receptionists = number_of_receptionists_input
-g.number_of_gps = number_of_gps_input
+scenario_parameters["number_of_receptionists"] = number_of_receptionists_input
+scenario_parameters["number_of_gps"] = number_of_gps_input
 
 # Branch probabilities
-g.prob_book_test = prob_book_test_input
+scenario_parameters["prob_book_test"] = prob_book_test_input
 
 # Simulation meta parameters
-g.sim_duration = sim_duration_input
-g.number_of_runs = number_of_runs_input
+scenario_parameters["sim_duration"] = sim_duration_input
+scenario_parameters["number_of_runs"] = number_of_runs_input
+scenario_parameters["random_seed"] = random_seed_input
+scenario_parameters["pregenerate_arrivals"] = pregenerate_arrivals_input
 
 
 ###########################################################
-# Run a trial using the parameters from the g class and   #
+# Run a trial using the parameters set above and          #
 # print the results                                       #
 ###########################################################
 
@@ -104,7 +177,15 @@ button_run_pressed = st.button("Run simulation")
 
 if button_run_pressed:
     with st.spinner('Simulating the system...'):
-        df_trial_results, caller_results, patient_results = Trial().run_trial()
+        # Look up the results for these parameters in the shared store, then in the disk cache,
+        # only running the trial if no-one has run this scenario yet
+        scenario_key = make_cache_key(scenario_parameters)
+        df_trial_results, caller_results, patient_results = result_store.get_or_run(
+            scenario_key,
+            lambda: trial_disk_cache.get_or_run(
+                scenario_key, lambda: run_trial_with_parameters(scenario_parameters)
+                )
+            )
 
         col1, col2, col3, col4 = st.columns(4)
 
@@ -124,16 +205,16 @@ if button_run_pressed:
 
         col5, col6 = st.columns([0.75, 0.25])
 
-        col5.metric(f"Median utilisation for {g.number_of_receptionists} receptionist(s)",
+        col5.metric(f"Median utilisation for {number_of_receptionists_input} receptionist(s)",
             f"{df_trial_results['Receptionist Utilisation - Percentage'].median():.1f}%")
 
-        col6.metric(f"Median utilisation for {g.number_of_gps} GP(s)",
+        col6.metric(f"Median utilisation for {number_of_gps_input} GP(s)",
                 f"{df_trial_results['GP Utilisation - Percentage'].median():.1f}%")
 
-        tab1, tab2, tab3, tab4, tab5 = st.tabs(
+        tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(
             ["Wait Summaries", "Utilisation Summaries",
              "Caller Charts", "Patient Charts",
-             "Raw Data"]
+             "Waits by LSOA", "Raw Data"]
         )
 
         ###########################################################
@@ -207,7 +288,7 @@ if button_run_pressed:
             # By default, plotly tries to intelligently choose a scale - but for this, it makes more sense to
             # include a label for every row (unless we have lots of runs, in which case we won't apply this
             # correction)
-            if g.number_of_runs < 20:
+            if number_of_runs_input < 20:
                 average_waits_fig.update_layout(yaxis = {'dtick': 1})
 
             # Finally, we force plotly to display the plot in the interactive window.
@@ -344,7 +425,7 @@ if button_run_pressed:
             # Ensure the run label appears on the x axis for each run unless there are lots of them, in
             # which case we'll just leave the value of dtick as the default (which means plotly will choose
             # a sensible value for us)
-            if g.number_of_runs < 20:
+            if number_of_runs_input < 20:
                 utilisation_bar_fig.update_layout(xaxis = {'dtick': 1})
 
             # Show the bar plot
@@ -425,7 +506,7 @@ if button_run_pressed:
             )
 
             # Ensure each column has a number on the x axis (if there aren't too many runs)
-            if g.number_of_runs < 20:
+            if number_of_runs_input < 20:
                 calls_answered_fig.update_layout(xaxis = {'dtick': 1})
 
             # Show the plot
@@ -529,7 +610,36 @@ if button_run_pressed:
         # building more complex excel files out of our pandas dataframes and other
         # python variables
 
+        ##############################################################
+        ##############################################################
+        # Break down the waits by the LSOA people came from           #
+        ##############################################################
+        ##############################################################
         with tab5:
+            if scenario_parameters["lsoa_codes"] is None:
+                st.write("Tick 'Record which LSOA each patient and caller comes from' in the "
+                         "sidebar and run the simulation again to see waits for each LSOA")
+            else:
+                st.subheader("Walk-in Patients")
+                st.dataframe(
+                    summarise_waits_by_origin(
+                        patient_results, scenario_parameters["lsoa_codes"],
+                        ["Queue Time Reg", "Queue Time GP", "Queue Time Book Test"],
+                        number_of_runs_input
+                        ).sort_values("Mean Queue Time GP", ascending=False),
+                    hide_index=True
+                    )
+
+                st.subheader("Callers")
+                st.dataframe(
+                    summarise_waits_by_origin(
+                        caller_results, scenario_parameters["lsoa_codes"], ["Queue Time Call"],
+                        number_of_runs_input
+                        ).sort_values("Mean Queue Time Call", ascending=False),
+                    hide_index=True
+                    )
+
+        with tab6:
             st.subheader("Trial Summaries")
             st.dataframe(df_trial_results)
 
@@ -542,7 +652,7 @@ if button_run_pressed:
                 st.download_button(
                     "Click here to download the dataframe as a csv file",
                     df_trial_results.to_csv().encode('utf-8'),
-                    f"trial_summary_{g.number_of_gps}_gps_{g.number_of_receptionists}_receptionists.csv",
+                    f"trial_summary_{number_of_gps_input}_gps_{number_of_receptionists_input}_receptionists.csv",
                     "text/csv")
             download_1()
 
@@ -555,7 +665,7 @@ if button_run_pressed:
                 st.download_button(
                     "Click here to download the dataframe as a csv file",
                     caller_results.to_csv().encode('utf-8'),
-                    f"caller_data_{g.number_of_gps}_gps_{g.number_of_receptionists}_receptionists.csv",
+                    f"caller_data_{number_of_gps_input}_gps_{number_of_receptionists_input}_receptionists.csv",
                     "text/csv")
             download_2()
 
@@ -566,6 +676,6 @@ if button_run_pressed:
                 st.download_button(
                     "Click here to download the dataframe as a csv file",
                     patient_results.to_csv().encode('utf-8'),
-                    f"patient_data_{g.number_of_gps}_gps_{g.number_of_receptionists}_receptionists.csv",
+                    f"patient_data_{number_of_gps_input}_gps_{number_of_receptionists_input}_receptionists.csv",
                     "text/csv")
             download_3()
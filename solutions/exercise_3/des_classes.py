@@ -3,11 +3,35 @@ import random
 import pandas as pd
 import numpy as np
 
+from arrival_profiles import sample_arrival_times, sample_exponential_arrival_times
+from origin_sampling import AliasSampler
+
 class g:
     # Inter-arrival times
     patient_inter = 3
     call_inter = 10
 
+    # Optional arrival profiles - the expected number of arrivals in each hour of the simulation
+    # (see arrival_profiles.py). If one of these is set, it is used instead of the matching
+    # inter-arrival time above, so arrivals can be busier at some times of day than others.
+    patient_arrival_profile = None
+    call_arrival_profile = None
+
+    # If this is True, every arrival time for a run is worked out before the run starts, rather
+    # than one at a time as the simulation goes along (see Model.run). The arrivals are drawn from
+    # their own random number generator, and each patient and caller gets their own generator for
+    # their activity times, so they are the same whatever else changes in the scenario - e.g.
+    # adding a GP doesn't change who turns up when, or how long each person's appointment takes,
+    # which makes comparing scenarios fairer. It gives different (but equally valid) results to
+    # leaving it False.
+    pregenerate_arrivals = False
+
+    # Optional list of LSOA codes that patients and callers come from, and how much demand comes
+    # from each one (e.g. the Projected Average Daily Demand). If these are set, every arrival is
+    # given an LSOA (see origin_sampling.py) so that waits can be broken down by area.
+    lsoa_codes = None
+    lsoa_weights = None
+
     # Activity times
     mean_reg_time = 2
     mean_gp_time = 8
@@ -24,6 +48,23 @@ class g:
     # Simulation meta parameters
     sim_duration = 480
     number_of_runs = 10
+    # Set this to a whole number to make the trial reproducible - each run uses the seed plus
+    # its run number. Leave it as None to get different results every time
+    random_seed = None
+
+# A copy of the default values above, taken as soon as this file is loaded (so before anything
+# gets a chance to change them). The g class is shared by everything in the same Python process -
+# including every user of the Streamlit app - so its current values may not be the defaults.
+G_DEFAULTS = {
+    name: value for name, value in vars(g).items()
+    if not name.startswith("_") and not callable(value)
+}
+
+# When arrivals are worked out in advance, patients and callers each get their own stream of
+# random numbers for their arrival times. These numbers pick the stream, so the two never share
+# random numbers (and adding a new stream later won't change the existing ones).
+PATIENT_ARRIVAL_STREAM = 0
+CALLER_ARRIVAL_STREAM = 1
 
 # Class representing patients coming in to the GP surgery
 class Patient:
@@ -35,6 +76,10 @@ class Patient:
         self.time_with_gp = 0
         self.q_time_book_test = 0
         self.time_with_receptionist = 0.0
+        self.origin = None
+        # Where this patient's activity times come from - Python's random module unless the
+        # model gives them their own generator (see Model.activity_rng)
+        self.rng = random
 
 # Class representing callers phoning the GP surgery
 class Caller:
@@ -43,11 +88,17 @@ class Caller:
         self.call_time = 0
         self.time_with_receptionist = 0.0
         self.q_time_call = 0
+        self.origin = None
+        # Where this caller's activity times come from (see Patient above)
+        self.rng = random
 
 # Class representing our model of the GP surgery
 class Model:
     # Constructor
-    def __init__(self, run_number):
+    # patient_arrival_times and call_arrival_times can optionally be given to replay the arrivals
+    # from an earlier run (e.g. from the patient_arrival_schedule of another Model) instead of
+    # sampling new ones
+    def __init__(self, run_number, patient_arrival_times=None, call_arrival_times=None):
         # Set up SimPy environment
         self.env = simpy.Environment()
 
@@ -70,6 +121,12 @@ class Model:
         # Set run number from value passed in
         self.run_number = run_number
 
+        # The arrival times for the run, if they are worked out in advance (either given to us to
+        # replay, or sampled at the start of run()). After the run, these can be looked at to see
+        # exactly when everyone arrived. They stay as None if arrivals are sampled as we go.
+        self.patient_arrival_schedule = patient_arrival_times
+        self.call_arrival_schedule = call_arrival_times
+
         # Set up DataFrame to store patient-level results
         self.patient_results_df = pd.DataFrame()
         self.patient_results_df["Patient ID"] = [1]
@@ -92,6 +149,21 @@ class Model:
         self.caller_results_df["Call End Time"] = [0.0]
         self.caller_results_df.set_index("Caller ID", inplace=True)
 
+        # If we've been given the LSOAs that arrivals come from, set up the sampler that picks
+        # one for each arrival, and add a column to the results to record it in.
+        # The LSOAs are picked using their own random number generator, so turning this on
+        # doesn't change any of the other random numbers in the model (and so doesn't change the
+        # waits). It is seeded from g.random_seed so the LSOAs are reproducible too.
+        if g.lsoa_codes is None:
+            self.origin_sampler = None
+        else:
+            self.origin_sampler = AliasSampler(g.lsoa_codes, g.lsoa_weights)
+            self.origin_rng = random.Random(
+                None if g.random_seed is None else f"origins-{g.random_seed}-{run_number}"
+                )
+            self.patient_results_df["LSOA21CD"] = [None]
+            self.caller_results_df["LSOA21CD"] = [None]
+
         # Set up attributes that will store mean queuing times across the run
         self.mean_q_time_reg = 0
         self.mean_q_time_gp = 0
@@ -102,15 +174,48 @@ class Model:
         self.receptionist_utilisation_prop = 0.0
         self.gp_utilisation_prop = 0.0
 
+    # Make the random number generator for one patient's or caller's activity times, if
+    # arrivals are being worked out in advance (otherwise they just use Python's random module,
+    # which gives the same results as before g.pregenerate_arrivals existed).
+    # The generator is seeded from who they are, so e.g. patient 8 in run 1 has the same
+    # registration and consultation times in every scenario with the same seed, however long
+    # they had to queue first.
+    def activity_rng(self, entity_type, entity_id):
+        if not g.pregenerate_arrivals:
+            return random
+        return random.Random(
+            None if g.random_seed is None else
+            f"activities-{g.random_seed}-{self.run_number}-{entity_type}-{entity_id}"
+            )
+
+    # Method to create a new patient and start their journey through the surgery
+    def new_patient(self):
+        self.patient_counter += 1
+
+        p = Patient(self.patient_counter)
+        p.rng = self.activity_rng("patient", p.id)
+        if self.origin_sampler is not None:
+            p.origin = self.origin_sampler.draw(self.origin_rng)
+        self.patient_objects.append(p) ##NEW
+
+        self.env.process(self.attend_gp_surgery(p))
+
+    # Method to create a new caller and start their call
+    def new_caller(self):
+        self.caller_counter += 1
+
+        c = Caller(self.caller_counter)
+        c.rng = self.activity_rng("caller", c.id)
+        if self.origin_sampler is not None:
+            c.origin = self.origin_sampler.draw(self.origin_rng)
+        self.caller_objects.append(c) ##NEW
+
+        self.env.process(self.call_gp_surgery(c))
+
     # Generator function that represents the DES generator for patient arrivals
     def generator_patient_arrivals(self):
         while True:
-            self.patient_counter += 1
-
-            p = Patient(self.patient_counter)
-            self.patient_objects.append(p) ##NEW
-
-            self.env.process(self.attend_gp_surgery(p))
+            self.new_patient()
 
             sampled_inter = random.expovariate(1.0 / g.patient_inter)
 
@@ -119,17 +224,46 @@ class Model:
     # Generator function that represents the DES generator for caller arrivals
     def generator_callers(self):
         while True:
-            self.caller_counter += 1
-
-            c = Caller(self.caller_counter)
-            self.caller_objects.append(c) ##NEW
-
-            self.env.process(self.call_gp_surgery(c))
+            self.new_caller()
 
             sampled_inter = random.expovariate(1.0 / g.call_inter)
 
             yield self.env.timeout(sampled_inter)
 
+    # Generator function that creates arrivals at times that have already been worked out
+    # (e.g. from an arrival profile). create_arrival is the method to call for each arrival.
+    def generator_scheduled_arrivals(self, arrival_times, create_arrival):
+        # Work out all of the gaps between arrivals in one go, and turn them into a plain Python
+        # list (looping over a list is quicker than looping over a numpy array)
+        inter_arrival_times = np.diff(np.asarray(arrival_times, dtype=float), prepend=0.0).tolist()
+
+        for inter_arrival_time in inter_arrival_times:
+            yield self.env.timeout(inter_arrival_time)
+
+            create_arrival()
+
+    # Sample the arrival times for a whole run from an hourly arrival profile
+    # We make a numpy random number generator from Python's random module, so that setting
+    # g.random_seed still makes the results reproducible
+    def sample_profile_arrivals(self, hourly_profile):
+        rng = np.random.default_rng(random.getrandbits(64))
+        return sample_arrival_times(hourly_profile, g.sim_duration, rng)
+
+    # Work out every arrival time for the run before it starts (if g.pregenerate_arrivals is True)
+    # An hourly profile is used if there is one, otherwise the constant inter-arrival time.
+    # The arrivals get their own random number generator, seeded from g.random_seed so they're
+    # reproducible, and kept separate from the ones used for activity times so the arrivals are
+    # the same in every scenario with the same demand.
+    # stream_id is PATIENT_ARRIVAL_STREAM or CALLER_ARRIVAL_STREAM
+    def pregenerate_arrival_schedule(self, mean_inter_arrival_time, hourly_profile, stream_id):
+        rng = np.random.default_rng(
+            None if g.random_seed is None else [g.random_seed, self.run_number, stream_id]
+            )
+
+        if hourly_profile is not None:
+            return sample_arrival_times(hourly_profile, g.sim_duration, rng)
+        return sample_exponential_arrival_times(mean_inter_arrival_time, g.sim_duration, rng)
+
     # Generator function representing pathway for patients attending the GP
     # surgery to see a GP
     def attend_gp_surgery(self, patient):
@@ -138,6 +272,8 @@ class Model:
         self.patient_results_df.at[patient.id, "Arrival Time"] = (
                 start_q_reg
             )
+        if patient.origin is not None:
+            self.patient_results_df.at[patient.id, "LSOA21CD"] = patient.origin
 
         with self.receptionist.request() as req:
             yield req
@@ -153,7 +289,7 @@ class Model:
                 start_q_reg + patient.q_time_reg
             )
 
-            sampled_reg_time = random.expovariate(
+            sampled_reg_time = patient.rng.expovariate(
                 1.0 / g.mean_reg_time
             )
 
@@ -178,7 +314,7 @@ class Model:
                 start_q_gp + patient.q_time_gp
             )
 
-            sampled_gp_time = random.expovariate(
+            sampled_gp_time = patient.rng.expovariate(
                 1.0 / g.mean_gp_time
             )
 
@@ -187,7 +323,7 @@ class Model:
             yield self.env.timeout(sampled_gp_time)
 
         # Branching path check to see if patient needs to book a test
-        if random.uniform(0,1) < g.prob_book_test:
+        if patient.rng.uniform(0,1) < g.prob_book_test:
             # Book test activity
             start_q_book_test = self.env.now
 
@@ -206,7 +342,7 @@ class Model:
                     start_q_book_test + patient.q_time_book_test
                 )
 
-                sampled_book_test_time = random.expovariate(
+                sampled_book_test_time = patient.rng.expovariate(
                     1.0 / g.mean_book_test_time
                 )
 
@@ -225,6 +361,8 @@ class Model:
         self.caller_results_df.at[caller.id, "Call Start Time"] = (
                 start_q_call
             )
+        if caller.origin is not None:
+            self.caller_results_df.at[caller.id, "LSOA21CD"] = caller.origin
 
         with self.receptionist.request() as req:
             yield req
@@ -241,7 +379,7 @@ class Model:
                 self.env.now
             )
 
-            sampled_call_time = random.expovariate(
+            sampled_call_time = caller.rng.expovariate(
                 1.0 / g.mean_call_time
             )
 
@@ -282,9 +420,43 @@ class Model:
 
     # Method to run a single run of the simulation
     def run(self):
+        # If arrivals are being worked out in advance, sample them now (unless we've been given
+        # some to replay). They are then used just like the arrivals from a profile below.
+        if g.pregenerate_arrivals:
+            if self.patient_arrival_schedule is None:
+                self.patient_arrival_schedule = self.pregenerate_arrival_schedule(
+                    g.patient_inter, g.patient_arrival_profile, PATIENT_ARRIVAL_STREAM
+                )
+            if self.call_arrival_schedule is None:
+                self.call_arrival_schedule = self.pregenerate_arrival_schedule(
+                    g.call_inter, g.call_arrival_profile, CALLER_ARRIVAL_STREAM
+                )
+
         # Start up DES generators
-        self.env.process(self.generator_patient_arrivals())
-        self.env.process(self.generator_callers())
+        # If the arrival times have already been worked out, we create the arrivals at those
+        # times. Otherwise, if there's an arrival profile, arrivals follow that instead of a
+        # constant inter-arrival time
+        if self.patient_arrival_schedule is not None:
+            self.env.process(self.generator_scheduled_arrivals(
+                self.patient_arrival_schedule, self.new_patient
+            ))
+        elif g.patient_arrival_profile is None:
+            self.env.process(self.generator_patient_arrivals())
+        else:
+            self.env.process(self.generator_scheduled_arrivals(
+                self.sample_profile_arrivals(g.patient_arrival_profile), self.new_patient
+            ))
+
+        if self.call_arrival_schedule is not None:
+            self.env.process(self.generator_scheduled_arrivals(
+                self.call_arrival_schedule, self.new_caller
+            ))
+        elif g.call_arrival_profile is None:
+            self.env.process(self.generator_callers())
+        else:
+            self.env.process(self.generator_scheduled_arrivals(
+                self.sample_profile_arrivals(g.call_arrival_profile), self.new_caller
+            ))
 
         # Run for the duration specified in g class
         self.env.run(until=g.sim_duration)
@@ -308,6 +480,12 @@ class Trial:
         self.df_trial_results["Receptionist Utilisation - Percentage"] = [0.0]
         self.df_trial_results.set_index("Run Number", inplace=True)
 
+        # The arrival times used in each run (keyed by run number), if they were worked out in
+        # advance - e.g. to check two scenarios had the same arrivals, or to replay a run by
+        # passing them back in to Model
+        self.patient_arrival_schedules = {}
+        self.call_arrival_schedules = {}
+
     # Method to calculate and store means across runs in the trial
     def calculate_means_over_trial(self):
         self.mean_q_time_reg_trial = (
@@ -329,8 +507,15 @@ class Trial:
         patient_dfs = []
 
         for run in range(1, g.number_of_runs+1):
+            if g.random_seed is not None:
+                random.seed(g.random_seed + run)
+
             my_model = Model(run)
             caller_df, patient_df = my_model.run()
+            if my_model.patient_arrival_schedule is not None:
+                self.patient_arrival_schedules[run] = my_model.patient_arrival_schedule
+            if my_model.call_arrival_schedule is not None:
+                self.call_arrival_schedules[run] = my_model.call_arrival_schedule
             caller_df["Run"] = run
             caller_df["What"] = "Callers"
             patient_df["Run"] = run
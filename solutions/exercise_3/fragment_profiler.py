@@ -0,0 +1,212 @@
+import functools
+import json
+import time
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+# This file lets us measure how long the different parts of a page take to run, so we can see
+# whether things like @st.fragment and caching are actually making the app quicker.
+#
+# Put @profile() underneath @st.fragment (or above @st.cache_data/@st.cache_resource) to time a
+# function, e.g.
+#
+#   @st.fragment
+#   @profile()
+#   def penguin_barchart():
+#       ...
+#
+# Every time the function runs, we record how long it took and which widget the user changed to
+# make it run. Call start_page_run() at the top of the page and show_performance_panel() at the
+# bottom to see the results.
+#
+# Working out which widget caused a rerun: Streamlit doesn't tell us this directly, but any widget
+# with a key= has its value stored in st.session_state. We keep a copy of those values after each
+# run, and any that are different next time must have been changed by the user. Widgets without
+# a key can't be tracked this way, so give the widgets you're interested in a key.
+#
+# Working out whether a fragment reran on its own: start_page_run() notes that the whole page is
+# running, and show_performance_panel() (at the bottom of the page) notes that it has finished.
+# Anything that runs outside of those two must have been a fragment rerunning by itself.
+#
+# This file is self-contained, so to use it in another app just copy it into that app's folder.
+
+# The file the timings get saved to if the user turns logging on
+LOG_PATH = "fragment_timings.jsonl"
+
+# Everything this file stores in session state goes under this key, so it doesn't get mixed up
+# with the app's own session state
+STATE_KEY = "_fragment_profiler"
+
+
+# Get (or set up) this user's stored timings
+def _profiler_state():
+    if STATE_KEY not in st.session_state:
+        st.session_state[STATE_KEY] = {
+            "page_runs": 0,
+            "page_running": False,
+            "page_trigger": "",
+            "running": [],
+            "timings": {},
+            "widget_values": {},
+            "logging": False,
+        }
+    return st.session_state[STATE_KEY]
+
+
+# Take a copy of the values of every widget that has a key
+# We store them as JSON text, which gives us a copy we can compare against later (even for values
+# like lists or dictionaries that the app might change)
+def _current_widget_values():
+    widget_values = {}
+    for key, value in st.session_state.items():
+        if str(key).startswith("_"):
+            continue
+        try:
+            widget_values[key] = json.dumps(value, sort_keys=True, default=str)
+        except (TypeError, ValueError):
+            continue
+    return widget_values
+
+
+# Work out which widgets have changed since we last looked, and remember their new values
+def _changed_widgets(state):
+    widget_values = _current_widget_values()
+    changed = sorted(
+        str(key) for key, value in widget_values.items()
+        if key in state["widget_values"] and state["widget_values"][key] != value
+    )
+    state["widget_values"] = widget_values
+    return changed
+
+
+# Save one record as a line of JSON at the end of the log file
+def _log(record, log_path=LOG_PATH):
+    with open(log_path, "a") as log_file:
+        log_file.write(json.dumps(record) + "\n")
+
+
+# The decorator that times a function (see the top of this file for how to use it)
+def profile(name=None):
+    def decorate(function):
+        profile_name = name or function.__name__
+
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            state = _profiler_state()
+            in_page_run = state["page_running"]
+
+            if state["running"]:
+                # This has been called from inside another profiled function (e.g. a cached
+                # function called by a fragment), so it was triggered by the same thing
+                trigger = state["running"][-1]
+            else:
+                # If nothing has changed since the page started running, this function is running
+                # as part of the page, so whatever made the page rerun made this run too
+                trigger = ", ".join(_changed_widgets(state))
+                if not trigger:
+                    trigger = (state["page_trigger"] if in_page_run
+                               else "unknown (widget without a key)")
+
+            state["running"].append(trigger)
+            start_time = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start_time
+                state["running"].pop()
+
+                # Take a new copy of the values now, so anything the function itself changed in
+                # session state isn't mistaken for the trigger of the next run
+                if not state["running"]:
+                    _changed_widgets(state)
+
+                timings = state["timings"].setdefault(
+                    profile_name,
+                    {"runs": 0, "reruns_on_own": 0, "total_seconds": 0.0, "max_seconds": 0.0,
+                     "last_seconds": 0.0, "last_trigger": ""}
+                )
+                timings["runs"] += 1
+                if not in_page_run:
+                    timings["reruns_on_own"] += 1
+                timings["total_seconds"] += seconds
+                timings["max_seconds"] = max(timings["max_seconds"], seconds)
+                timings["last_seconds"] = seconds
+                timings["last_trigger"] = trigger
+
+                if state["logging"]:
+                    _log({
+                        "time": datetime.now().isoformat(timespec="seconds"),
+                        "name": profile_name,
+                        "seconds": seconds,
+                        "run": timings["runs"],
+                        "page_run": state["page_runs"],
+                        "rerun_on_own": not in_page_run,
+                        "trigger": trigger,
+                    })
+
+        return timed_function
+
+    return decorate
+
+
+# Call this at the top of the page, so we can tell full page runs apart from fragment reruns
+def start_page_run():
+    state = _profiler_state()
+    state["page_runs"] += 1
+    state["page_running"] = True
+    # Clear out anything left over if the last run stopped part-way through
+    state["running"] = []
+
+    changed = _changed_widgets(state)
+    if state["page_runs"] == 1:
+        state["page_trigger"] = "page load"
+    else:
+        state["page_trigger"] = "page run: " + (", ".join(changed) or "widget without a key")
+
+
+# A table of the timings for everything that has been profiled
+def performance_summary():
+    state = _profiler_state()
+    return pd.DataFrame(
+        [
+            {
+                "Name": name,
+                "Runs": timings["runs"],
+                "Reruns on its own": timings["reruns_on_own"],
+                "Last (ms)": timings["last_seconds"] * 1000,
+                "Mean (ms)": timings["total_seconds"] / timings["runs"] * 1000,
+                "Max (ms)": timings["max_seconds"] * 1000,
+                "Last triggered by": timings["last_trigger"],
+            }
+            for name, timings in state["timings"].items()
+        ],
+        columns=["Name", "Runs", "Reruns on its own", "Last (ms)", "Mean (ms)", "Max (ms)",
+                 "Last triggered by"]
+    )
+
+
+# Show the timings in a collapsible panel - call this at the bottom of the page
+# The panel itself is a fragment, so the 'Refresh' button updates it without rerunning the rest of
+# the page (otherwise it would only update when the whole page reruns)
+def show_performance_panel():
+    # The page has finished running, so anything that runs after this is a fragment rerun
+    state = _profiler_state()
+    state["page_running"] = False
+    _changed_widgets(state)
+
+    _performance_panel()
+
+
+@st.fragment
+def _performance_panel():
+    state = _profiler_state()
+
+    with st.expander("Performance"):
+        st.write(f"Full page runs: {state['page_runs']}")
+        st.dataframe(performance_summary(), hide_index=True)
+
+        state["logging"] = st.checkbox(f"Save timings to {LOG_PATH}", value=state["logging"],
+                                       key="_fragment_profiler_logging")
+        st.button("Refresh", key="_fragment_profiler_refresh")
@@ -0,0 +1,250 @@
+import argparse
+import math
+import os
+import time
+
+import geopandas
+import numpy as np
+import shapely
+
+# This file contains the functions that prepare the LSOA dataset for the map page (lsoa_map.py).
+# It doesn't use streamlit itself - the map page wraps these functions in Streamlit's caching
+# decorators so they only run when they need to.
+
+# Reading the original GeoJSON file is slow, because it's one big block of text that has to be
+# read and turned into shapes every time the app starts up. GeoParquet stores the same data in a
+# compact binary format, column by column, which is much quicker to load and uses less memory
+# while loading.
+# We keep the GeoJSON as the 'source' file, and build the GeoParquet file from it once using
+#
+#   python lsoa_data.py build
+#
+# If the GeoJSON is changed after that, the GeoParquet file will be out of date (it's 'stale'),
+# so we check the files' modification times and rebuild it when needed.
+GEOJSON_PATH = "lsoa_demand_demographics.geojson"
+GEOPARQUET_PATH = "lsoa_demand_demographics.parquet"
+
+# The share of the projected demand that phones the clinic - the rest walk in
+CALLS_PROPORTION = 0.2
+
+# The only columns the map actually needs - the LSOA code (to match the shapes to the demand data)
+# and the demand itself (which appears in the tooltip)
+TOOLTIP_COLUMNS = ["LSOA21CD", "Projected Average Daily Demand"]
+
+# The level of detail we simplify the LSOA boundaries to, as a web map zoom level.
+# The map opens at zoom 9 (a whole county), but people will zoom in a few levels to look at their
+# local area, so we keep enough detail to still look right at zoom 12 (roughly a town).
+MAP_DETAIL_ZOOM = 12
+
+# Number of decimal places to keep in the coordinates we send to the browser.
+# 5 decimal places of a degree is about 1 metre - far more precise than we can see on the map.
+COORDINATE_DECIMAL_PLACES = 5
+
+
+# Work out how much we can simplify the boundaries by without anyone noticing on the map.
+# At zoom level z a web map is 256 * 2^z pixels wide and covers 360 degrees of longitude,
+# so one pixel covers 360 / (256 * 2^z) degrees. Any detail smaller than about half a pixel
+# can't be seen, so that's what we use as the tolerance.
+def simplification_tolerance(zoom=MAP_DETAIL_ZOOM):
+    degrees_per_pixel = 360 / (256 * math.pow(2, zoom))
+    return degrees_per_pixel / 2
+
+
+# Make a lightweight copy of the LSOA boundaries for drawing on the web map
+# - we drop every column except the ones used in the tooltip, so they aren't sent to the browser
+# - we simplify the boundaries (preserve_topology=True makes sure this never creates broken shapes)
+# - we round the coordinates so each one takes up fewer characters in the GeoJSON
+def simplify_for_web(lsoa_demographics, zoom=MAP_DETAIL_ZOOM):
+    # The map needs latitude and longitude, so convert the data if it's stored in another
+    # coordinate system (e.g. British National Grid)
+    lsoa_web = lsoa_demographics[TOOLTIP_COLUMNS + ["geometry"]].to_crs(epsg=4326)
+
+    lsoa_web["geometry"] = (
+        lsoa_web.geometry
+        .simplify(simplification_tolerance(zoom), preserve_topology=True)
+        .set_precision(math.pow(10, -COORDINATE_DECIMAL_PLACES))
+    )
+
+    return lsoa_web
+
+
+# Turn the simplified boundaries into the GeoJSON text that folium sends to the browser
+# drop_id=True stops geopandas adding an extra 'id' to every shape, which we don't use
+def to_geojson_payload(lsoa_web):
+    return lsoa_web.to_json(drop_id=True)
+
+
+# Get the row positions of every LSOA in the selected regions, in their original order
+# region_index is a dictionary of region name -> array of row positions (see load_map_data)
+def region_positions(region_index, selected_regions):
+    if len(selected_regions) == 0:
+        return np.array([], dtype=int)
+    return np.sort(np.concatenate([region_index[region] for region in selected_regions]))
+
+
+# Work out the demand for the LSOAs that are ticked
+# demand is a numpy array of the projected daily demand for each LSOA shown in the table, and
+# include_mask is an array of True/False values saying which ones are ticked.
+# Multiplying the two together and adding up (a 'dot product') gives us the total demand for the
+# ticked LSOAs in one step, without having to make a filtered copy of the dataframe first.
+# We then split that total between calls and walk-ins, and work out the average time between
+# arrivals over a day of the given length.
+def aggregate_demand(demand, include_mask, calls_proportion=CALLS_PROPORTION, day_length=480):
+    total_demand = np.dot(demand, include_mask)
+
+    demand_calls = total_demand * calls_proportion
+    demand_walkins = total_demand * (1 - calls_proportion)
+
+    return {
+        "total": total_demand,
+        "calls": demand_calls,
+        "walk_ins": demand_walkins,
+        "iat_calls": day_length / demand_calls,
+        "iat_walk_ins": day_length / demand_walkins,
+    }
+
+
+# Build a spatial index of the LSOA boundaries, so we can quickly find which LSOA a point on the map
+# is in. An STRtree groups nearby shapes into boxes (and boxes into bigger boxes), so a lookup only
+# has to check the handful of LSOAs whose boxes contain the point rather than every LSOA.
+# The tree numbers the shapes in the same order as the rows of lsoa_demographics, so the lookups
+# below give back row positions.
+def build_spatial_index(lsoa_demographics):
+    # Clicks on the map come back as latitude and longitude, so the index needs to use them too
+    return shapely.STRtree(lsoa_demographics.geometry.to_crs(epsg=4326).values)
+
+
+# Find the row position of the LSOA containing a clicked point (an empty array if the click
+# wasn't inside any LSOA)
+def lsoas_at_point(spatial_index, longitude, latitude):
+    return spatial_index.query(shapely.Point(longitude, latitude), predicate="intersects")
+
+
+# Find the row positions of every LSOA that overlaps a shape drawn on the map
+# drawn_shape is a GeoJSON geometry dictionary, as returned by the map
+def lsoas_in_shape(spatial_index, drawn_shape):
+    return spatial_index.query(shapely.geometry.shape(drawn_shape), predicate="intersects")
+
+
+# Add the columns the app needs, and store repeated text as pandas 'categoricals'.
+# This is done once when the GeoParquet file is built, rather than every time the app loads.
+#
+# The region is the LSOA name without the number and letter on the end, e.g. "Exeter 001A" is in
+# "Exeter".
+#
+# A categorical column stores each different value once, plus a small number per row saying which
+# value that row has. For a column like Region, where thousands of rows share a few hundred values,
+# this uses much less memory than storing the text on every row - and operations like isin,
+# drop_duplicates and sort_values only need to look at the small list of values.
+# Columns where every row is different (like the LSOA code or name) don't benefit - a categorical
+# would just store every value plus a number per row - so we only convert columns where values
+# are repeated a lot (fewer than CATEGORICAL_MAX_UNIQUE_RATIO different values per row).
+CATEGORICAL_MAX_UNIQUE_RATIO = 0.5
+
+def prepare_lsoa_dataset(lsoa_demographics):
+    lsoa_demographics["Region"] = (
+        lsoa_demographics["LSOA21NM"].str.replace(r"( \d{3})\w", "", regex=True).str.strip()
+    )
+
+    text_columns = lsoa_demographics.select_dtypes(include=["object", "string"]).columns
+    for column in text_columns:
+        if column == "geometry":
+            continue
+        unique_ratio = lsoa_demographics[column].nunique() / max(len(lsoa_demographics), 1)
+        if unique_ratio < CATEGORICAL_MAX_UNIQUE_RATIO:
+            lsoa_demographics[column] = lsoa_demographics[column].astype("category")
+
+    return lsoa_demographics
+
+
+# Read the original GeoJSON file and prepare it
+def read_geojson(source=GEOJSON_PATH):
+    return prepare_lsoa_dataset(geopandas.read_file(source))
+
+
+# Save the prepared dataset as a GeoParquet file
+# We write to a temporary file first and then rename it, so the app can never pick up a
+# half-written file. GeoParquet remembers which columns are categoricals, so they come back
+# the same way when we load the file.
+def write_geoparquet(lsoa_demographics, target=GEOPARQUET_PATH):
+    temp_target = f"{target}.tmp"
+    lsoa_demographics.to_parquet(temp_target, index=False)
+    os.replace(temp_target, target)
+
+
+# Convert the GeoJSON file into a GeoParquet file
+def build_geoparquet(source=GEOJSON_PATH, target=GEOPARQUET_PATH):
+    lsoa_demographics = read_geojson(source)
+    write_geoparquet(lsoa_demographics, target)
+    return lsoa_demographics
+
+
+# Check whether the GeoParquet file exists and was made after the GeoJSON was last changed
+# If there's no GeoJSON file at all (e.g. you've only deployed the GeoParquet file), we treat the
+# GeoParquet file as being up to date
+def geoparquet_is_fresh(source=GEOJSON_PATH, target=GEOPARQUET_PATH):
+    if not os.path.exists(target):
+        return False
+    if not os.path.exists(source):
+        return True
+    return os.path.getmtime(target) >= os.path.getmtime(source)
+
+
+# Load the LSOA dataset, using the GeoParquet file if it's up to date
+# If it isn't, we rebuild it from the GeoJSON (if build_if_stale is True) or just read the GeoJSON
+def read_lsoa_dataset(source=GEOJSON_PATH, target=GEOPARQUET_PATH, build_if_stale=True):
+    if geoparquet_is_fresh(source, target):
+        lsoa_demographics = geopandas.read_parquet(target)
+        # Files built before the Region column was added need preparing here instead
+        if "Region" not in lsoa_demographics.columns:
+            lsoa_demographics = prepare_lsoa_dataset(lsoa_demographics)
+        return lsoa_demographics
+
+    lsoa_demographics = read_geojson(source)
+
+    if build_if_stale:
+        try:
+            write_geoparquet(lsoa_demographics, target)
+        except OSError:
+            # We might not be allowed to write files (e.g. on some hosting services) - in that
+            # case we just carry on with the GeoJSON
+            pass
+
+    return lsoa_demographics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prepare the LSOA dataset for the map page")
+    parser.add_argument("command", choices=["build", "check"])
+    parser.add_argument("--source", default=GEOJSON_PATH)
+    parser.add_argument("--target", default=GEOPARQUET_PATH)
+    parser.add_argument("--force", action="store_true", help="Rebuild even if up to date")
+    args = parser.parse_args()
+
+    fresh = geoparquet_is_fresh(args.source, args.target)
+
+    if args.command == "check":
+        print(f"{args.target} is {'up to date' if fresh else 'missing or out of date'}")
+        return
+
+    if fresh and not args.force:
+        print(f"{args.target} is already up to date - use --force to rebuild it")
+        return
+
+    start_time = time.perf_counter()
+    lsoa_demographics = build_geoparquet(args.source, args.target)
+    print(f"Wrote {len(lsoa_demographics)} LSOAs to {args.target} "
+          f"in {time.perf_counter() - start_time:.1f} seconds")
+
+    # Show how much quicker the new file is to load
+    start_time = time.perf_counter()
+    geopandas.read_file(args.source)
+    print(f"Loading {args.source} takes {time.perf_counter() - start_time:.2f} seconds")
+
+    start_time = time.perf_counter()
+    geopandas.read_parquet(args.target)
+    print(f"Loading {args.target} takes {time.perf_counter() - start_time:.2f} seconds")
+
+
+if __name__ == "__main__":
+    main()
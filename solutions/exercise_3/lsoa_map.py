@@ -1,13 +1,26 @@
 import streamlit as st
-import geopandas
 import pandas as pd
+import numpy as np
 import folium
 import random
+from streamlit.errors import StreamlitAPIException
 from streamlit_folium import st_folium
 import time
 
+from lsoa_data import (aggregate_demand, build_spatial_index, lsoas_at_point, lsoas_in_shape,
+                       read_lsoa_dataset, region_positions, simplify_for_web, to_geojson_payload)
+from arrival_profiles import ARRIVAL_PATTERNS, make_hourly_profile
+from lsoa_tiles import TILE_URL, demand_colour_scale, tiles_are_built, vector_grid_options
+from folium.plugins import Draw, VectorGridProtobuf
+from fragment_profiler import profile, show_performance_panel, start_page_run
+
 st.set_page_config(layout="wide")
 
+# Tell the profiler the whole page is running, so it can tell full page runs apart from the map
+# fragment rerunning on its own - the timings are shown at the bottom of the page
+# (see fragment_profiler.py)
+start_page_run()
+
 st.logo("hsma_logo.png")
 
 # Here I'm initialising a session state variable that will be used to store the selected regions.
@@ -16,6 +29,22 @@ st.logo("hsma_logo.png")
 if 'selected_regions' not in st.session_state:
     st.session_state.selected_regions = ['Exeter']
 
+# As well as using the table, users can click on LSOAs on the map (or draw a shape around them) to
+# add them to the demand, or click on an LSOA that's ticked in the table to take it out of the
+# demand. We keep track of those here, as row positions in the full dataset.
+# We also remember the last click we dealt with, as the map keeps sending back the same click
+# every time the page reruns.
+if 'map_clicked_lsoas' not in st.session_state:
+    st.session_state.map_clicked_lsoas = set()
+if 'map_drawn_lsoas' not in st.session_state:
+    st.session_state.map_drawn_lsoas = set()
+if 'map_removed_lsoas' not in st.session_state:
+    st.session_state.map_removed_lsoas = set()
+if 'last_map_click' not in st.session_state:
+    st.session_state.last_map_click = None
+if 'map_version' not in st.session_state:
+    st.session_state.map_version = 0
+
 # While we will set some more session state variables here, I have opted to initialise them in the
 # app.py file instead of in here. This is a neat trick in multipage apps that prevents you from
 # having to repeat the initialisation code in multiple places.
@@ -49,10 +78,15 @@ st.warning("This is just a sample app for demonstration purposes!")
 # only need to run once, it's a bit more efficient to also include them in our cached function
 # We could also split that into it's own cached function, but it involves a bit more passing
 # around of variables to function which is just a bit more faff
+# @profile() times each call to the function (whether or not the cache is used) - it goes above
+# the caching decorator. See fragment_profiler.py.
+@profile()
 @st.cache_data
 def load_map_data():
-    lsoa_demographics = geopandas.read_file("lsoa_demand_demographics.geojson")
-    lsoa_demographics["Region"] = lsoa_demographics["LSOA21NM"].str.replace("( \d{3})\w", "", regex=True).str.strip()
+    # This loads the fast GeoParquet copy of lsoa_demand_demographics.geojson, creating it first if
+    # it doesn't exist yet or the GeoJSON has changed (see lsoa_data.py)
+    # The Region column is added (and stored as a categorical) when that file is built.
+    lsoa_demographics = read_lsoa_dataset()
 
     new_col = True
 
@@ -62,43 +96,164 @@ def load_map_data():
 
     df_display.insert(loc=2, column='Include', value=new_col)
 
-    return lsoa_demographics, df_display
+    # We also build an 'index' of which rows belong to each region, so that later on we can pick
+    # out the rows for the selected regions by position instead of checking every row's region
+    # name each time the selection changes.
+    # groupby(...).indices gives us a dictionary like {"Exeter": array([0, 1, 5, ...]), ...}
+    # and it's already sorted alphabetically by region.
+    # observed=True tells pandas to only include regions that actually appear in the data
+    region_index = lsoa_demographics.groupby("Region", observed=True).indices
+
+    return lsoa_demographics, df_display, region_index
 
-# Notice that here we have run load_map_data() within the fragment.
+# A sorted list of regions for the multiselect - this only needs working out once
+@st.cache_data
+def get_region_list():
+    lsoa_demographics, df_display, region_index = load_map_data()
+    return list(region_index.keys())
+
+# Get the rows for a particular selection of regions
+# Because this is cached too, switching back to a selection of regions that has been used
+# before is almost instant - we just get the stored subset back.
+# We pass the regions in as a sorted tuple so that e.g. ("Exeter", "Torbay") and
+# ("Torbay", "Exeter") count as the same selection. max_entries stops the cache growing forever
+# if users try lots of different combinations.
+@profile()
+@st.cache_data(max_entries=50)
+def get_region_subset(selected_regions):
+    lsoa_demographics, df_display, region_index = load_map_data()
+
+    positions = region_positions(region_index, selected_regions)
+
+    # We also hand back the positions of these rows in the full dataset, so we can match them up
+    # with the demand array below and with LSOAs selected on the map
+    return df_display.iloc[positions], positions
+
+# The demand for every LSOA as a plain numpy array, so we can add up the demand for the
+# selected rows really quickly (see aggregate_demand in lsoa_data.py)
+@st.cache_data
+def get_all_demand():
+    lsoa_demographics, df_display, region_index = load_map_data()
+    return lsoa_demographics["Projected Average Daily Demand"].to_numpy()
+
+# The code for every LSOA, in the same order as the demand array above
+@st.cache_data
+def get_all_lsoa_codes():
+    lsoa_demographics, df_display, region_index = load_map_data()
+    return lsoa_demographics["LSOA21CD"].to_numpy()
+
+# The spatial index used to work out which LSOA has been clicked on the map (see lsoa_data.py)
+# This has to use @st.cache_resource as the index can't be copied in the way @st.cache_data needs
+@st.cache_resource
+def get_spatial_index():
+    lsoa_demographics, df_display, region_index = load_map_data()
+    return build_spatial_index(lsoa_demographics)
+
+# Sending the full-detail LSOA boundaries to the browser is the slowest part of drawing the map.
+# Here we make a simplified copy of the boundaries with only the columns the tooltip needs
+# (see lsoa_data.py for the details).
+# We use @st.cache_resource instead of @st.cache_data because we never change this dataframe -
+# cache_resource hands back the same object every time rather than making a fresh copy, which
+# saves time with a large dataset.
+@st.cache_resource
+def load_web_geometries():
+    lsoa_demographics, df_display, region_index = load_map_data()
+    return simplify_for_web(lsoa_demographics)
+
+# Turn the simplified boundaries for the chosen regions into the GeoJSON text for the map.
+# This is cached for each combination of regions (and any LSOAs unticked in the table), so going
+# back to a previous selection doesn't need the boundaries converting all over again.
+@profile()
+@st.cache_data(max_entries=50)
+def get_choropleth_geojson(selected_regions, excluded_lsoas):
+    lsoa_demographics, df_display, region_index = load_map_data()
+    lsoa_web = load_web_geometries()
+
+    lsoa_web = lsoa_web.iloc[region_positions(region_index, selected_regions)]
+    lsoa_web = lsoa_web[~lsoa_web["LSOA21CD"].isin(excluded_lsoas)]
+
+    return to_geojson_payload(lsoa_web)
+
+# Everything the vector tile map needs from the full dataset - every LSOA code (so we can work out
+# which ones to hide) and the colour scale used when the tiles were built (for the legend)
+@st.cache_data
+def get_tile_layer_inputs():
+    lsoa_demographics, df_display, region_index = load_map_data()
+    demand = lsoa_demographics["Projected Average Daily Demand"]
+    return tuple(lsoa_demographics["LSOA21CD"]), float(demand.min()), float(demand.max())
+
+# Rerun just the map fragment if we can - but Streamlit only allows that when the fragment is
+# already rerunning on its own (e.g. after a click on the map), so if the whole page is running
+# we rerun the whole page instead
+def rerun_map():
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+# Notice that here we have run our data functions within the fragment.
 # This ensures that the lsoa_demographics and df_display variables are available to the rest of
 # the code in the fragment
 # The fragment can't access variables that are defined outside of the fragment, so you will need to
 # pass them in to the function or define them within the function (as we've done here)
+#
+# @profile() goes below @st.fragment so it times every rerun of the fragment, and records which
+# input triggered it. The inputs in the fragment have been given a key= so the profiler can tell
+# them apart.
 @st.fragment
+@profile()
 def get_map():
 
-    lsoa_demographics, df_display = load_map_data()
-
     st.session_state.selected_regions = st.multiselect(
         "Select Regions to Include",
-        lsoa_demographics["Region"].drop_duplicates().sort_values().tolist(),
-        default=st.session_state.selected_regions
+        get_region_list(),
+        default=st.session_state.selected_regions,
+        key="region_select"
     )
 
-    edited_df = st.data_editor(
-        df_display[df_display["Region"].isin(st.session_state.selected_regions)]
+    df_display, positions = get_region_subset(
+        tuple(sorted(st.session_state.selected_regions))
+        )
+
+    edited_df = st.data_editor(df_display, key="lsoa_table")
+
+    # The rows of edited_df are in the same order as our positions array, so the 'Include' column
+    # tells us directly which LSOAs to count - apart from any that have been clicked on the map
+    # to take them out again
+    table_mask = edited_df["Include"].to_numpy(dtype=bool)
+    removed_on_map_mask = table_mask & np.isin(
+        positions, list(st.session_state.map_removed_lsoas)
         )
+    include_mask = table_mask & ~removed_on_map_mask
+    included_df = edited_df[include_mask]
 
-    lsoa_demographics = pd.merge(
-        lsoa_demographics,
-        edited_df[edited_df["Include"] == True][["LSOA21CD"]],
-        how="inner"
+    # Add in any LSOAs picked on the map that aren't already ticked in the table
+    map_selected_positions = np.array(
+        sorted(st.session_state.map_clicked_lsoas | st.session_state.map_drawn_lsoas), dtype=int
         )
+    extra_map_positions = np.setdiff1d(map_selected_positions, positions[table_mask])
+
+    all_demand = get_all_demand()
+    selected_mask = np.zeros(len(all_demand), dtype=bool)
+    selected_mask[positions[include_mask]] = True
+    selected_mask[extra_map_positions] = True
+
+    demand_summary = aggregate_demand(all_demand, selected_mask)
 
-    demand_calls = lsoa_demographics['Projected Average Daily Demand'].sum()*0.2
-    demand_walkins = lsoa_demographics['Projected Average Daily Demand'].sum()*0.8
+    demand_calls = demand_summary["calls"]
+    demand_walkins = demand_summary["walk_ins"]
 
     # Here we are storing the demand and
     st.session_state.calls_demand = demand_calls
     st.session_state.walk_in_demand = demand_walkins
 
-    iat_calls = 480/(lsoa_demographics['Projected Average Daily Demand'].sum()*0.2)
-    iat_walkins = 480/(lsoa_demographics['Projected Average Daily Demand'].sum()*0.8)
+    # We also store which LSOAs make up that demand, and how much each one contributes, so the
+    # simulation page can record which LSOA each patient comes from
+    st.session_state.selected_lsoa_codes = get_all_lsoa_codes()[selected_mask].tolist()
+    st.session_state.selected_lsoa_weights = all_demand[selected_mask].tolist()
+
+    iat_calls = demand_summary["iat_calls"]
+    iat_walkins = demand_summary["iat_walk_ins"]
 
     st.write(f"Projected Daily Demand - Calls: {demand_calls:.1f}")
     st.write(f"Average IAT: {iat_calls:.1f} minutes (assuming 480 minute day)")
@@ -106,6 +261,44 @@ def get_map():
     st.write(f"Projected Daily Demand - Walk-ins: {demand_walkins:.1f}")
     st.write(f"Average IAT - Walk-ins: {iat_walkins:.1f} minutes (assuming 480 minute day)")
 
+    # Demand isn't usually spread evenly across the day. Here we turn the daily demand into the
+    # expected number of arrivals in each hour (an 'arrival profile'), which the simulation page
+    # can use to make arrivals busier at some times than others (see arrival_profiles.py)
+    arrival_pattern = st.selectbox("Arrival pattern across the day", list(ARRIVAL_PATTERNS.keys()),
+                                   key="arrival_pattern")
+
+    st.session_state.calls_profile = make_hourly_profile(
+        demand_calls, ARRIVAL_PATTERNS[arrival_pattern]
+        )
+    st.session_state.walk_in_profile = make_hourly_profile(
+        demand_walkins, ARRIVAL_PATTERNS[arrival_pattern]
+        )
+
+    with st.expander("Click here to see the expected arrivals for each hour of the day"):
+        st.bar_chart(
+            pd.DataFrame({
+                "Hour of Clinic Day": range(1, len(st.session_state.walk_in_profile) + 1),
+                "Walk-ins": st.session_state.walk_in_profile,
+                "Calls": st.session_state.calls_profile
+            }).set_index("Hour of Clinic Day")
+        )
+
+    st.caption(
+        "Click an LSOA on the map to add or remove it, or use the drawing tools on the left of "
+        "the map to draw a shape around the LSOAs you want to add."
+        )
+    st.write(f"LSOAs added from the map: {len(extra_map_positions)}")
+    st.write(f"LSOAs removed on the map: {removed_on_map_mask.sum()}")
+
+    if st.button("Clear map selection", key="clear_map_selection"):
+        st.session_state.map_clicked_lsoas = set()
+        st.session_state.map_drawn_lsoas = set()
+        st.session_state.map_removed_lsoas = set()
+        st.session_state.last_map_click = None
+        # Changing the key of the map resets it, which removes any shapes drawn on it
+        st.session_state.map_version += 1
+        rerun_map()
+
     #create base map
     demand_demographic_map_interactive = folium.Map(
         location=[50.71671, -3.50668],
@@ -113,31 +306,121 @@ def get_map():
         tiles='cartodbpositron'
         )
 
-    # create and add choropleth map
-    choropleth = folium.Choropleth(
-        geo_data=lsoa_demographics, # dataframe with geometry in it
-        data=lsoa_demographics, # dataframe with data in - may be the same dataframe or a different one
-        columns=['LSOA21CD', 'Projected Average Daily Demand'], # [key (field for geometry), field to plot]
-        key_on='feature.properties.LSOA21CD',
-        fill_color='OrRd',
-        fill_opacity=0.4,
-        line_weight=0.3,
-        legend_name='Projected Average Daily Demand',
-        highlight=True, # highlight the LSOA shape when mouse pointer enters it
-        smooth_factor=0
+    # With lots of LSOAs selected, the map can get very slow because every boundary is sent to the
+    # browser at once. The 'vector tiles' option instead only sends the part of the map that's on
+    # screen (see lsoa_tiles.py). It needs the tiles to have been built first.
+    map_mode = st.radio(
+        "Map rendering mode",
+        ["Standard", "Vector tiles (faster with lots of LSOAs selected)"],
+        horizontal=True,
+        key="map_mode"
         )
 
-    choropleth = choropleth.add_to(demand_demographic_map_interactive)
+    if map_mode != "Standard" and not tiles_are_built():
+        st.warning("Vector tiles haven't been built yet - run 'python lsoa_tiles.py build' "
+                   "from the app folder. Showing the standard map instead.")
+        map_mode = "Standard"
 
-    choropleth = choropleth.geojson.add_child(
-        folium.features.GeoJsonTooltip(
-            ['LSOA21CD', 'Projected Average Daily Demand'],
-            labels=True
+    if map_mode == "Standard":
+        # Get the simplified boundaries of the LSOAs we're showing
+        geojson_payload = get_choropleth_geojson(
+            tuple(sorted(st.session_state.selected_regions)),
+            tuple(sorted(edited_df[~include_mask]["LSOA21CD"]))
+            )
+
+        # create and add choropleth map
+        choropleth = folium.Choropleth(
+            geo_data=geojson_payload, # simplified boundaries as GeoJSON text
+            data=included_df, # dataframe with data in - may be the same dataframe or a different one
+            columns=['LSOA21CD', 'Projected Average Daily Demand'], # [key (field for geometry), field to plot]
+            key_on='feature.properties.LSOA21CD',
+            fill_color='OrRd',
+            fill_opacity=0.4,
+            line_weight=0.3,
+            legend_name='Projected Average Daily Demand',
+            highlight=True, # highlight the LSOA shape when mouse pointer enters it
+            smooth_factor=0
             )
-    )
 
-    st_folium(demand_demographic_map_interactive,
-            use_container_width=True)
+        choropleth = choropleth.add_to(demand_demographic_map_interactive)
+
+        choropleth = choropleth.geojson.add_child(
+            folium.features.GeoJsonTooltip(
+                ['LSOA21CD', 'Projected Average Daily Demand'],
+                labels=True
+                )
+        )
+    else:
+        all_lsoas, demand_min, demand_max = get_tile_layer_inputs()
+
+        VectorGridProtobuf(
+            TILE_URL,
+            "LSOA demand",
+            vector_grid_options(included_df["LSOA21CD"], all_lsoas)
+            ).add_to(demand_demographic_map_interactive)
+
+        # The colours are stored in the tiles, so we just need to add a matching legend
+        legend = demand_colour_scale([demand_min, demand_max])
+        legend.caption = 'Projected Average Daily Demand'
+        legend.add_to(demand_demographic_map_interactive)
+
+    # Outline the LSOAs picked on the map that are outside of the table selection
+    if len(extra_map_positions) > 0:
+        folium.GeoJson(
+            to_geojson_payload(load_web_geometries().iloc[extra_map_positions]),
+            name="Selected on map",
+            style_function=lambda feature: {
+                "fillColor": "#005EB8", "color": "#005EB8", "weight": 1.5, "fillOpacity": 0.3
+                },
+            tooltip=folium.features.GeoJsonTooltip(
+                ['LSOA21CD', 'Projected Average Daily Demand'], labels=True
+                )
+            ).add_to(demand_demographic_map_interactive)
+
+    # Add tools for drawing a polygon or rectangle around LSOAs
+    Draw(
+        draw_options={"polyline": False, "circle": False, "marker": False,
+                      "circlemarker": False, "polygon": True, "rectangle": True},
+        edit_options={"edit": False}
+        ).add_to(demand_demographic_map_interactive)
+
+    # returned_objects means the page only reruns when the user clicks or draws on the map,
+    # rather than every time they move or zoom it
+    map_output = st_folium(demand_demographic_map_interactive,
+            use_container_width=True,
+            returned_objects=["last_clicked", "all_drawings"],
+            key=f"lsoa_map_{st.session_state.map_version}")
+
+    # Work out which LSOAs have been picked on the map, using the spatial index
+    spatial_index = get_spatial_index()
+    map_selection_changed = False
+
+    last_clicked = (map_output or {}).get("last_clicked")
+    if last_clicked is not None and last_clicked != st.session_state.last_map_click:
+        st.session_state.last_map_click = last_clicked
+        # Clicking an LSOA adds it if it wasn't already picked, or removes it if it was
+        # LSOAs ticked in the table are taken out (or put back) separately, as we can't untick
+        # them in the table for the user
+        table_positions = set(positions[table_mask].tolist())
+        for position in lsoas_at_point(spatial_index, last_clicked["lng"], last_clicked["lat"]):
+            if int(position) in table_positions:
+                st.session_state.map_removed_lsoas ^= {int(position)}
+            else:
+                st.session_state.map_clicked_lsoas ^= {int(position)}
+            map_selection_changed = True
+
+    drawn_lsoas = set()
+    for drawing in (map_output or {}).get("all_drawings") or []:
+        drawn_lsoas.update(int(position) for position in
+                           lsoas_in_shape(spatial_index, drawing["geometry"]))
+    if drawn_lsoas != st.session_state.map_drawn_lsoas:
+        st.session_state.map_drawn_lsoas = drawn_lsoas
+        map_selection_changed = True
+
+    # The demand figures above were worked out before we knew about this click, so rerun the
+    # fragment to update them
+    if map_selection_changed:
+        rerun_map()
 
 # Here we call our fragment function to get it to display on the page
 get_map()
@@ -161,3 +444,7 @@ time.sleep(3)
 st.write("Long-running calculation complete!")
 
 st.write(f"The answer is {random.randint(100, 500)}")
+
+# Show how long the map fragment and the cached functions have taken, in a collapsible panel
+# Each click on the map should only add a run to get_map, not to the whole page
+show_performance_panel()
@@ -0,0 +1,240 @@
+import argparse
+import json
+import math
+import time
+from pathlib import Path
+
+import branca.colormap
+import numpy as np
+import shapely
+
+from lsoa_data import TOOLTIP_COLUMNS, read_lsoa_dataset
+
+# This file turns the LSOA boundaries into 'vector tiles' for the map page.
+#
+# Normally folium sends every LSOA boundary we're showing to the browser in one go. With every LSOA
+# in the country selected, that's a huge amount of data to send and draw. Vector tiles split the
+# map up into a grid of small squares (tiles) for each zoom level, and the browser only asks for
+# the tiles that are actually on screen at the current zoom.
+#
+# Tiles are built once from the command line with
+#
+#   python lsoa_tiles.py build
+#
+# and saved in the static/lsoa_tiles folder. Streamlit can serve files from a folder called
+# 'static' next to the app when 'enableStaticServing' is turned on in .streamlit/config.toml,
+# so the tiles are available at /app/static/lsoa_tiles/{z}/{x}/{y}.pbf without having to run
+# a separate tile server.
+#
+# Building tiles needs the mapbox_vector_tile package ('pip install mapbox-vector-tile').
+
+TILE_DIR = Path("static") / "lsoa_tiles"
+
+# The address the browser uses to fetch tiles - {z}, {x} and {y} are filled in by the map
+TILE_URL = "/app/static/lsoa_tiles/{z}/{x}/{y}.pbf"
+
+# The name of the layer inside each tile
+TILE_LAYER_NAME = "lsoa"
+
+# Tiles are built for zoom levels MIN_TILE_ZOOM to MAX_TILE_ZOOM by default. When the user zooms
+# in further than the most detailed zoom level that was built, the map just enlarges those tiles
+# (and zooming out further than the least detailed level shrinks those ones).
+MIN_TILE_ZOOM = 6
+MAX_TILE_ZOOM = 12
+
+# The zoom levels that were actually built are saved in this file in the tile folder, so the map
+# only asks for tiles that exist (they can be changed with --min-zoom and --max-zoom)
+TILE_METADATA_FILE = "metadata.json"
+
+# Each tile is a grid of TILE_EXTENT x TILE_EXTENT points (this is the standard value)
+TILE_EXTENT = 4096
+
+# Web maps use the 'Web Mercator' projection (EPSG:3857), where the whole world is a square that
+# runs from -WORLD_HALF_WIDTH to +WORLD_HALF_WIDTH metres in both directions
+WORLD_HALF_WIDTH = 20037508.342789244
+
+
+# Work out the edges of a tile (in Web Mercator metres) from its zoom level and x/y position
+def tile_bounds(zoom, x, y):
+    tile_size = 2 * WORLD_HALF_WIDTH / math.pow(2, zoom)
+    min_x = -WORLD_HALF_WIDTH + x * tile_size
+    max_y = WORLD_HALF_WIDTH - y * tile_size
+    return min_x, max_y - tile_size, min_x + tile_size, max_y
+
+
+# Work out which tiles cover an area (given in Web Mercator metres) at a zoom level
+def tiles_covering(bounds, zoom):
+    tile_size = 2 * WORLD_HALF_WIDTH / math.pow(2, zoom)
+    min_x, min_y, max_x, max_y = bounds
+
+    first_x = int((min_x + WORLD_HALF_WIDTH) // tile_size)
+    last_x = int((max_x + WORLD_HALF_WIDTH) // tile_size)
+    first_y = int((WORLD_HALF_WIDTH - max_y) // tile_size)
+    last_y = int((WORLD_HALF_WIDTH - min_y) // tile_size)
+
+    for x in range(first_x, last_x + 1):
+        for y in range(first_y, last_y + 1):
+            yield x, y
+
+
+# Pick a colour for each LSOA based on its demand, using the same OrRd colour scheme as the
+# choropleth. We store the colour in the tiles so the browser doesn't need to work it out.
+def demand_colour_scale(demand):
+    return branca.colormap.linear.OrRd_06.scale(float(np.min(demand)), float(np.max(demand)))
+
+
+# Build every tile for the LSOA dataset and save them in tile_dir
+def build_tiles(lsoa_demographics, tile_dir=TILE_DIR,
+                min_zoom=MIN_TILE_ZOOM, max_zoom=MAX_TILE_ZOOM):
+    # mapbox_vector_tile is only needed for building tiles, so we only import it here
+    try:
+        import mapbox_vector_tile
+    except ImportError as error:
+        raise ImportError(
+            "Building vector tiles needs mapbox_vector_tile - "
+            "install it with 'pip install mapbox-vector-tile'"
+        ) from error
+
+    lsoa_tiles = lsoa_demographics[TOOLTIP_COLUMNS + ["geometry"]].to_crs(epsg=3857)
+    colour_scale = demand_colour_scale(lsoa_tiles["Projected Average Daily Demand"])
+
+    properties = [
+        {
+            "LSOA21CD": code,
+            "demand": round(float(demand), 2),
+            "fill": colour_scale(demand)[:7],
+        }
+        for code, demand in zip(lsoa_tiles["LSOA21CD"],
+                                lsoa_tiles["Projected Average Daily Demand"])
+    ]
+
+    geometries = lsoa_tiles.geometry.values
+    spatial_index = lsoa_tiles.sindex
+
+    tile_count = 0
+
+    for zoom in range(min_zoom, max_zoom + 1):
+        for x, y in tiles_covering(lsoa_tiles.total_bounds, zoom):
+            bounds = tile_bounds(zoom, x, y)
+
+            # Include a little of the area around the tile so the edges of shapes don't show
+            # as lines where two tiles meet
+            buffer = (bounds[2] - bounds[0]) * 16 / TILE_EXTENT
+            buffered_bounds = (bounds[0] - buffer, bounds[1] - buffer,
+                               bounds[2] + buffer, bounds[3] + buffer)
+
+            # The spatial index lets us quickly find just the LSOAs that overlap this tile
+            lsoa_positions = spatial_index.query(shapely.box(*buffered_bounds))
+            if len(lsoa_positions) == 0:
+                continue
+
+            # Cut the LSOAs down to the tile, then simplify them to the detail we can see
+            # at this zoom (one point on the tile's grid)
+            clipped = shapely.clip_by_rect(geometries[lsoa_positions], *buffered_bounds)
+            clipped = shapely.simplify(
+                clipped, (bounds[2] - bounds[0]) / TILE_EXTENT, preserve_topology=True
+                )
+
+            features = [
+                {"geometry": geometry, "properties": properties[position]}
+                for position, geometry in zip(lsoa_positions, clipped)
+                if not geometry.is_empty
+            ]
+            if len(features) == 0:
+                continue
+
+            tile = mapbox_vector_tile.encode(
+                [{"name": TILE_LAYER_NAME, "features": features}],
+                default_options={"quantize_bounds": bounds, "extents": TILE_EXTENT}
+            )
+
+            tile_path = Path(tile_dir) / str(zoom) / str(x) / f"{y}.pbf"
+            tile_path.parent.mkdir(parents=True, exist_ok=True)
+            tile_path.write_bytes(tile)
+            tile_count += 1
+
+    Path(tile_dir).mkdir(parents=True, exist_ok=True)
+    (Path(tile_dir) / TILE_METADATA_FILE).write_text(
+        json.dumps({"min_zoom": min_zoom, "max_zoom": max_zoom, "tile_count": tile_count})
+    )
+
+    return tile_count
+
+
+# The (least detailed, most detailed) zoom levels that have been built, or None if the tiles
+# haven't been built yet
+def built_zoom_levels(tile_dir=TILE_DIR):
+    try:
+        metadata = json.loads((Path(tile_dir) / TILE_METADATA_FILE).read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+    return metadata["min_zoom"], metadata["max_zoom"]
+
+
+# Check whether the tiles have been built
+def tiles_are_built(tile_dir=TILE_DIR):
+    return built_zoom_levels(tile_dir) is not None
+
+
+# Write the JavaScript options for the vector tile layer on the map.
+# Tiles always contain every LSOA, so to only show the LSOAs the user has chosen we send the
+# browser a list of LSOA codes. To keep that list short, we send whichever is smaller: the codes
+# to show, or the codes to hide.
+# minNativeZoom and maxNativeZoom tell the map which zoom levels have tiles, so at any other zoom
+# it shrinks or enlarges the nearest level instead of asking for tiles that don't exist.
+def vector_grid_options(included_lsoas, all_lsoas, tile_dir=TILE_DIR):
+    min_zoom, max_zoom = built_zoom_levels(tile_dir) or (MIN_TILE_ZOOM, MAX_TILE_ZOOM)
+    included_lsoas = set(included_lsoas)
+
+    if len(included_lsoas) <= len(all_lsoas) - len(included_lsoas):
+        codes = sorted(included_lsoas)
+        codes_are_shown = "true"
+    else:
+        codes = sorted(set(all_lsoas) - included_lsoas)
+        codes_are_shown = "false"
+
+    codes_js = ",".join(f'"{code}":1' for code in codes)
+
+    return f"""{{
+        "minNativeZoom": {min_zoom},
+        "maxNativeZoom": {max_zoom},
+        "interactive": true,
+        "getFeatureId": function(feature) {{ return feature.properties.LSOA21CD; }},
+        "vectorTileLayerStyles": {{
+            "{TILE_LAYER_NAME}": (function() {{
+                // The list of codes is set up once, rather than for every LSOA drawn
+                var codes = {{{codes_js}}};
+                return function(properties, zoom) {{
+                    var shown = (properties.LSOA21CD in codes) === {codes_are_shown};
+                    if (!shown) {{
+                        return {{"fill": false, "stroke": false}};
+                    }}
+                    return {{
+                        "fill": true,
+                        "fillColor": properties.fill,
+                        "fillOpacity": 0.4,
+                        "color": "#000000",
+                        "weight": 0.3
+                    }};
+                }};
+            }})()
+        }}
+    }}"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build vector tiles of the LSOA boundaries")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--tile-dir", default=TILE_DIR)
+    parser.add_argument("--min-zoom", type=int, default=MIN_TILE_ZOOM)
+    parser.add_argument("--max-zoom", type=int, default=MAX_TILE_ZOOM)
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    tile_count = build_tiles(read_lsoa_dataset(), args.tile_dir, args.min_zoom, args.max_zoom)
+    print(f"Built {tile_count} tiles in {args.tile_dir} "
+          f"in {time.perf_counter() - start_time:.1f} seconds")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+# This file contains the functions for recording which LSOA each patient or caller comes from.
+#
+# The demand page adds up the demand from every LSOA the user has chosen, so by the time we get to
+# the simulation we only know the total number of arrivals. To see which areas are affected most
+# by long waits, each arrival in the model is given an 'origin' - an LSOA picked at random, with
+# busier LSOAs (higher Projected Average Daily Demand) picked more often.
+#
+# With thousands of LSOAs to choose from, picking one by working through a list of running totals
+# gets slow when we need to do it for every arrival. Instead we use the 'alias method', which does
+# a bit of set-up work once and then picks each LSOA in the same (short) time however many LSOAs
+# there are.
+
+
+# Picks LSOAs at random in proportion to their weights using the alias method (Vose's version)
+#
+# The idea is to imagine a row of n equally sized buckets, one for each LSOA. Each bucket is
+# filled with part of its own LSOA's weight, and topped up with weight from one other LSOA (its
+# 'alias'). Picking then only takes two random numbers: one to choose a bucket, and one to choose
+# between the bucket's own LSOA and its alias.
+class AliasSampler:
+    def __init__(self, codes, weights):
+        self.codes = list(codes)
+
+        weights = np.asarray(weights, dtype=float)
+        if len(weights) != len(self.codes):
+            raise ValueError("There must be one weight for each LSOA code")
+        if len(weights) == 0 or weights.sum() <= 0 or (weights < 0).any():
+            raise ValueError("Weights must not be negative, and at least one must be above zero")
+
+        n = len(weights)
+
+        # Scale the weights so that an 'average' LSOA has a weight of exactly 1 (one full bucket)
+        scaled = weights * n / weights.sum()
+
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+
+        # Sort the LSOAs into ones that don't fill a bucket and ones that overfill one
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+
+        # Top up each under-filled bucket from an overfilled LSOA, which then has less left over
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+
+            scaled[l] = scaled[l] + scaled[s] - 1
+            if scaled[l] < 1:
+                small.append(l)
+            else:
+                large.append(l)
+
+        # Anything left over is (apart from tiny rounding errors) exactly one full bucket
+        for i in small + large:
+            self.prob[i] = 1.0
+
+        # Plain lists are quicker than numpy arrays when we only look up one value at a time
+        self._prob_list = self.prob.tolist()
+        self._alias_list = self.alias.tolist()
+
+    # Pick a single LSOA code, using a random number generator from Python's random module
+    def draw(self, rng):
+        bucket = rng.randrange(len(self._prob_list))
+        if rng.random() < self._prob_list[bucket]:
+            return self.codes[bucket]
+        return self.codes[self._alias_list[bucket]]
+
+
+# Work out the number of arrivals and the average of each wait column for every LSOA
+#
+# results_df - patient or caller results with an LSOA21CD column
+# lsoa_codes - every LSOA that arrivals could have come from (so LSOAs with no arrivals still
+#              appear in the table)
+# wait_columns - the columns to average, e.g. ["Queue Time Reg", "Queue Time GP"]
+# number_of_runs - used to turn the total arrivals across the trial into arrivals per run
+#
+# Rather than a pandas groupby, we turn each LSOA code into a number (its position in lsoa_codes)
+# and use np.bincount, which adds up values for each number in a single pass through the data.
+# This stays quick even with thousands of LSOAs and hundreds of thousands of arrivals.
+def summarise_waits_by_origin(results_df, lsoa_codes, wait_columns, number_of_runs=1):
+    lsoa_codes = list(lsoa_codes)
+    n = len(lsoa_codes)
+
+    # Arrivals from an LSOA not in lsoa_codes (or with no LSOA recorded) get a position of -1
+    positions = pd.Categorical(results_df["LSOA21CD"], categories=lsoa_codes).codes
+    recorded = positions >= 0
+
+    summary = pd.DataFrame({"LSOA21CD": lsoa_codes})
+    summary["Arrivals per Run"] = (
+        np.bincount(positions[recorded], minlength=n) / number_of_runs
+    )
+
+    for column in wait_columns:
+        waits = results_df[column].to_numpy(dtype=float)
+
+        # People who were still waiting when the simulation ended don't have a wait recorded
+        # (it's NaN), so we leave them out - the same as pandas does when working out a mean
+        has_wait = recorded & ~np.isnan(waits)
+
+        total_wait = np.bincount(positions[has_wait], weights=waits[has_wait], minlength=n)
+        number_waiting = np.bincount(positions[has_wait], minlength=n)
+
+        summary[f"Mean {column}"] = np.divide(
+            total_wait, number_waiting,
+            out=np.full(n, np.nan), where=number_waiting > 0
+            )
+
+    return summary
@@ -0,0 +1,263 @@
+import copy
+import hashlib
+import json
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+from des_classes import G_DEFAULTS, Trial, g
+
+# This file contains a store for simulation results that can be shared by every user of the app.
+#
+# Streamlit reruns our scripts separately for every user (session), so if ten people open the
+# app and press 'Run simulation' with the default settings, we would normally run exactly the same
+# trial ten times. Instead, we work out a 'key' from the parameters in the g class, and if another
+# session has already run that scenario we just hand back the stored results.
+#
+# The store lives in memory and is capped at a maximum size. When it gets too big, the results
+# that were used least recently are thrown away first (a 'least recently used' or LRU cache).
+# Optionally, results can also be written to a SQLite database file so they can be picked back up
+# if they have been evicted from memory.
+#
+# This file doesn't import streamlit - in the app, we wrap the store in @st.cache_resource so that
+# a single store is shared across every session (see des.py).
+
+
+# Pull the current parameter values out of the g class as a dictionary
+# We skip anything beginning with an underscore (the things Python adds to every class
+# automatically) and anything callable (methods)
+def get_scenario_parameters():
+    return {
+        name: value for name, value in sorted(vars(g).items())
+        if not name.startswith("_") and not callable(value)
+    }
+
+
+# The default parameters from the g class, as a dictionary in the same form as above
+# This comes from the copy of the defaults taken when des_classes.py was loaded, so it isn't
+# affected by anything that has changed the g class since (e.g. another user of the app)
+def default_scenario_parameters():
+    return copy.deepcopy(dict(sorted(G_DEFAULTS.items())))
+
+
+# Set the values in the g class from a dictionary of parameters (the opposite of the function above)
+# This is useful when running scenarios outside of the app, e.g. from the command line
+def apply_scenario_parameters(parameters):
+    for name, value in parameters.items():
+        if not hasattr(g, name):
+            raise ValueError(f"'{name}' is not a parameter of the g class")
+        setattr(g, name, value)
+
+
+# Only one trial at a time can use the g class in each process - see run_trial_with_parameters
+_g_class_lock = threading.Lock()
+
+
+# Run a trial with a dictionary of parameters (like the one from get_scenario_parameters())
+# The model reads its parameters from the g class, which is shared by every user of the app. The
+# lock means no other trial can change the g class while this one is setting it up and running,
+# so the results always match the parameters (and so the key they are stored under).
+def run_trial_with_parameters(parameters):
+    with _g_class_lock:
+        apply_scenario_parameters(parameters)
+        return Trial().run_trial()
+
+
+# json can't turn numpy values or arrays into text on its own, so we give it a helping hand
+def _json_default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"Can't use a value of type {type(value).__name__} in a scenario key")
+
+
+# Turn a dictionary of parameters into a short, fixed-length string that we can use as a key
+# Sorting the keys means the same parameters always give the same key, regardless of the
+# order they were set in
+def make_scenario_key(parameters):
+    parameters_as_text = json.dumps(parameters, sort_keys=True, default=_json_default)
+    return hashlib.sha256(parameters_as_text.encode("utf-8")).hexdigest()
+
+
+# Estimate how much memory a result takes up
+# Our trial results are a tuple of pandas dataframes, so we can ask pandas for an accurate figure
+# (deep=True makes it include the memory used by text columns too)
+def estimate_result_size(result):
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(deep=True).sum())
+    if isinstance(result, (tuple, list)):
+        return sum(estimate_result_size(item) for item in result)
+    return len(pickle.dumps(result))
+
+
+# Class representing a process-wide store of simulation results
+class ResultStore:
+    # Constructor
+    # max_bytes - the approximate maximum amount of memory the stored results can use
+    # persist_path - optional path to a SQLite database file to also save results to
+    def __init__(self, max_bytes=256 * 1024 * 1024, persist_path=None):
+        self.max_bytes = max_bytes
+        self.persist_path = persist_path
+
+        # An OrderedDict remembers the order things were added in, and lets us move an entry to
+        # the end when it's used - so the entry at the start is always the least recently used
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self.current_bytes = 0
+
+        # Set up counters used for reporting how well the store is working
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_hits = 0
+
+        # Streamlit serves each session in its own thread, so we need to make sure two
+        # sessions can't change the store at exactly the same time.
+        self._lock = threading.Lock()
+        # We also keep one lock per scenario so that if two users request the same new scenario
+        # at the same time, the second one waits for the first instead of running it again
+        self._scenario_locks = {}
+
+        if self.persist_path is not None:
+            with closing(self._connect()) as connection, connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS results "
+                    "(key TEXT PRIMARY KEY, created REAL, size INTEGER, payload BLOB)"
+                )
+
+    def _connect(self):
+        return sqlite3.connect(self.persist_path, timeout=30)
+
+    # Method to look up a result in memory, then on disk (if turned on)
+    # Returns None if we don't have the result
+    # We return a copy so that one session changing its dataframes (e.g. adding a column)
+    # can't affect what other sessions see
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(self._entries[key])
+
+        result = self._read_from_disk(key)
+
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._add_to_memory(key, result)
+
+        return copy.deepcopy(result)
+
+    # Method to add a result to the store
+    def put(self, key, result):
+        with self._lock:
+            self._add_to_memory(key, result)
+        self._write_to_disk(key, result)
+
+    # Method to return the stored result if we have it, or otherwise call run_function to
+    # calculate it and store it for next time
+    def get_or_run(self, key, run_function):
+        result = self.get(key)
+        if result is not None:
+            return result
+
+        with self._lock:
+            scenario_lock = self._scenario_locks.setdefault(key, threading.Lock())
+
+        with scenario_lock:
+            # Another session may have finished running this scenario while we were waiting
+            # for the lock, so check again before doing the work ourselves
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    # get() counted this as a miss, but we've ended up using the stored result
+                    self.misses -= 1
+                    self.hits += 1
+                    return copy.deepcopy(self._entries[key])
+
+            result = run_function()
+            self.put(key, result)
+
+        with self._lock:
+            self._scenario_locks.pop(key, None)
+
+        return copy.deepcopy(result)
+
+    # Method to empty the in-memory part of the store
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.current_bytes = 0
+
+    # Method to report on the current state of the store
+    def stats(self):
+        with self._lock:
+            stats = {
+                "entries": len(self._entries),
+                "memory_mb": self.current_bytes / (1024 * 1024),
+                "max_memory_mb": self.max_bytes / (1024 * 1024),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+        if self.persist_path is not None:
+            with closing(self._connect()) as connection, connection:
+                stats["disk_entries"] = connection.execute(
+                    "SELECT COUNT(*) FROM results"
+                ).fetchone()[0]
+
+        return stats
+
+    # Must be called while holding self._lock
+    def _add_to_memory(self, key, result):
+        if key in self._entries:
+            self.current_bytes -= self._sizes[key]
+
+        size = estimate_result_size(result)
+        self._entries[key] = result
+        self._sizes[key] = size
+        self._entries.move_to_end(key)
+        self.current_bytes += size
+
+        # Throw away the least recently used results until we're back under the limit
+        # We always keep the newest result, even if on its own it's bigger than the limit
+        while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+            evicted_key, _ = self._entries.popitem(last=False)
+            self.current_bytes -= self._sizes.pop(evicted_key)
+            self.evictions += 1
+
+    def _read_from_disk(self, key):
+        if self.persist_path is None:
+            return None
+        with closing(self._connect()) as connection, connection:
+            row = connection.execute(
+                "SELECT payload FROM results WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0])
+
+    def _write_to_disk(self, key, result):
+        if self.persist_path is None:
+            return
+        payload = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO results (key, created, size, payload) VALUES (?, ?, ?, ?)",
+                (key, time.time(), len(payload), payload)
+            )
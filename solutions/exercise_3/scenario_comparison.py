@@ -0,0 +1,133 @@
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from statistics import NormalDist
+
+import pandas as pd
+
+from batch_runner import run_scenario
+from trial_cache import make_cache_key
+
+# This file contains the code behind the 'Compare Scenarios' page - running two scenarios side by
+# side and working out how different their results are.
+#
+# The two scenarios use the same random seed with g.pregenerate_arrivals turned on, so run 1 of
+# scenario A and run 1 of scenario B get the same random numbers: the same patients arriving at
+# the same times, each with the same activity times (see des_classes.py). This is called 'common
+# random numbers'. It means any difference between the two runs comes from the changes we made to
+# the scenario, rather than from one run just being luckier than the other.
+# (Just using the same seed isn't enough - with one shared stream of random numbers, a change like
+# adding a GP changes the order the numbers get used in, and the runs soon go out of step.)
+# Because of this, we compare the runs in pairs (run 1 of A against run 1 of B, and so on) and
+# look at the average of those differences - which gives a much tighter confidence interval than
+# comparing the two sets of runs as a whole.
+#
+# Each scenario is cached separately (using the same key as the 'Run Simulation' page), so
+# changing scenario B and running the comparison again only needs to run scenario B.
+#
+# Like result_store.py and trial_cache.py, this file doesn't import streamlit.
+
+# The measures from the trial results that we compare
+COMPARISON_MEASURES = [
+    "Mean Queue Time Reg",
+    "Mean Queue Time GP",
+    "Mean Queue Time Book Test",
+    "Mean Queue Time Call",
+    "GP Utilisation - Percentage",
+    "Receptionist Utilisation - Percentage",
+]
+
+
+# Work out the 't' value used for a confidence interval, e.g. about 2.26 for a 95% interval
+# with 9 degrees of freedom (10 paired runs)
+# scipy would normally do this for us, but it isn't one of the app's requirements, so we use the
+# exact formulas for 1 and 2 degrees of freedom and a well-known approximation based on the normal
+# distribution for anything bigger (this is within 1% of the exact value from 3 upwards)
+def t_critical_value(confidence, degrees_of_freedom):
+    p = 1 - (1 - confidence) / 2
+
+    if degrees_of_freedom == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if degrees_of_freedom == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+
+    z = NormalDist().inv_cdf(p)
+    df = degrees_of_freedom
+    return (z
+            + (z**3 + z) / (4 * df)
+            + (5 * z**5 + 16 * z**3 + 3 * z) / (96 * df**2)
+            + (3 * z**7 + 19 * z**5 + 17 * z**3 - 15 * z) / (384 * df**3)
+            + (79 * z**9 + 776 * z**7 + 1482 * z**5 - 1920 * z**3 - 945 * z) / (92160 * df**4))
+
+
+# Work out the difference between each pair of runs (scenario B minus scenario A)
+# results_a and results_b are the trial results dataframes, with one row per run
+def paired_run_differences(results_a, results_b, measures=COMPARISON_MEASURES):
+    return results_b[measures] - results_a[measures]
+
+
+# Summarise the paired differences for each measure, with a confidence interval
+# If the interval doesn't include 0, we can be fairly confident that the change between the two
+# scenarios really does make a difference to that measure
+# With only one run we can't work out a confidence interval, so those columns are left blank
+def paired_differences(results_a, results_b, confidence=0.95, measures=COMPARISON_MEASURES):
+    differences = paired_run_differences(results_a, results_b, measures)
+
+    number_of_pairs = differences.count()
+    mean_difference = differences.mean()
+    standard_error = differences.std(ddof=1) / number_of_pairs.pow(0.5)
+
+    margin = pd.Series(
+        [t_critical_value(confidence, n - 1) if n > 1 else float("nan")
+         for n in number_of_pairs],
+        index=number_of_pairs.index
+    ) * standard_error
+
+    summary = pd.DataFrame({
+        "Scenario A": results_a[measures].mean(),
+        "Scenario B": results_b[measures].mean(),
+        "Mean Difference (B - A)": mean_difference,
+        "Lower CI": mean_difference - margin,
+        "Upper CI": mean_difference + margin,
+    })
+    summary["Clear Difference"] = (summary["Lower CI"] > 0) | (summary["Upper CI"] < 0)
+    summary.index.name = "Measure"
+
+    return summary.reset_index()
+
+
+# Run the scenarios at the same time, each in its own process, and return their results
+# scenarios - a dictionary of name -> full set of g class parameters
+# result_store - the shared in-memory ResultStore (see result_store.py)
+# cache_dir - the folder of the on-disk cache (see trial_cache.py)
+#
+# Each scenario is looked up in the result store first, then in the disk cache (which
+# run_scenario checks for us), and only run if neither has it - so a scenario that hasn't changed
+# comes straight back from the cache.
+# The model is set up through the g class, which is shared by everything in a process, so two
+# scenarios can't run in the same process at the same time. Instead each one runs in a separate
+# process, and we use a thread per scenario to wait for it.
+#
+# The processes are started with 'spawn' (a fresh Python that imports what it needs) rather than
+# 'fork' (a copy of this process). The Streamlit server runs every user's session in its own
+# thread, and fork only copies the thread doing the forking - so if another user's trial was
+# holding the g class lock in result_store.py at that moment, the copied lock stays locked for
+# ever and the scenario never runs. Spawn doesn't copy anything, so it can't inherit a held lock.
+# (A spawned process loads the app's main script, app.py, before running the scenario - outside of
+# 'streamlit run' that does nothing, so this works as long as the app is started from app.py.)
+def run_scenarios_concurrently(scenarios, result_store, cache_dir=None):
+    keys = {name: make_cache_key(parameters) for name, parameters in scenarios.items()}
+
+    # The processes are only started if a scenario actually needs running
+    with ProcessPoolExecutor(max_workers=len(scenarios),
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        def get_result(name):
+            return result_store.get_or_run(
+                keys[name],
+                lambda: executor.submit(run_scenario, name, scenarios[name], cache_dir).result()[1]
+            )
+
+        with ThreadPoolExecutor(max_workers=len(scenarios)) as threads:
+            results = list(threads.map(get_result, scenarios))
+
+    return dict(zip(scenarios, results))
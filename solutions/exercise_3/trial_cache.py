@@ -0,0 +1,238 @@
+import argparse
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from des_classes import g, Trial
+from result_store import apply_scenario_parameters, get_scenario_parameters, make_scenario_key
+
+# This file contains a cache of trial results that is saved to disk, so the results survive the
+# Streamlit server being restarted.
+#
+# Each result is saved in its own file, named after a 'key' worked out from
+#   - the parameters in the g class (which includes the number of runs and the random seed)
+#   - the version of the model code (a fingerprint of des_classes.py and the files it uses)
+# This means that if the model code changes, old results are automatically ignored rather than
+# being handed back by mistake. Because the file name is worked out from what's *in* the scenario,
+# this is sometimes called 'content-addressed' storage.
+#
+# When the folder gets bigger than the maximum size, the files that were used least recently are
+# deleted first.
+#
+# You can use this file from the command line too - for example, to run the default app scenario
+# before opening hours so the first visitors don't have to wait:
+#
+#   python trial_cache.py warm --walk-in-demand 150 --calls-demand 50 --seed 42
+#   python trial_cache.py stats
+#   python trial_cache.py clear
+
+DEFAULT_CACHE_DIR = Path(__file__).parent / "trial_cache"
+
+# The files the model's results depend on - des_classes.py and the files it imports code from.
+# If you make des_classes.py use another file of your own, add it here too.
+MODEL_CODE_PATHS = (
+    Path(__file__).parent / "des_classes.py",
+    Path(__file__).parent / "arrival_profiles.py",
+    Path(__file__).parent / "origin_sampling.py",
+)
+
+
+# Work out a short fingerprint of the model code
+# If anyone edits any of the files above, this changes, and so do all of the cache keys
+def model_code_version():
+    fingerprint = hashlib.sha256()
+    for path in MODEL_CODE_PATHS:
+        # Include the file name, so moving code from one file to another changes the fingerprint
+        fingerprint.update(path.name.encode("utf-8"))
+        fingerprint.update(path.read_bytes())
+    return fingerprint.hexdigest()[:16]
+
+
+# Work out the cache key for a set of parameters (as returned by get_scenario_parameters())
+def make_cache_key(parameters):
+    return make_scenario_key(
+        {"parameters": parameters, "model_code_version": model_code_version()}
+    )
+
+
+# Class representing the on-disk cache of trial results
+class TrialDiskCache:
+    # Constructor
+    # cache_dir - the folder the results will be saved in (created if it doesn't exist)
+    # max_bytes - the maximum total size of the files in the folder
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=1024 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+
+    # Files are split into subfolders using the first two characters of the key, so we don't end up
+    # with thousands of files in a single folder
+    def _path_for_key(self, key):
+        return self.cache_dir / key[:2] / f"{key}.pkl"
+
+    # Method to load a result from disk - returns None if we don't have it
+    def get(self, key):
+        path = self._path_for_key(key)
+        try:
+            with open(path, "rb") as f:
+                result = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception:
+            # The file is there but can't be loaded - e.g. it's damaged, or it was saved with a
+            # different version of pandas or numpy (which the key doesn't know about). Either way
+            # it's no use to us, so we delete it and run the scenario again as if it wasn't there.
+            path.unlink(missing_ok=True)
+            self.misses += 1
+            return None
+
+        # Update the 'last modified' time of the file so we know it was used recently
+        # (another process sharing the cache folder may have just deleted it, which is fine -
+        # we've already loaded the result)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        return result
+
+    # Method to save a result to disk
+    # We write to a temporary file first and then rename it, so that another process reading the
+    # cache at the same time never sees a half-written file
+    def put(self, key, result):
+        path = self._path_for_key(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".tmp", delete=False) as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            temp_path = f.name
+        os.replace(temp_path, path)
+
+        self.evict()
+
+    # Method to return the cached result if there is one, or otherwise call run_function and
+    # save what it returns
+    def get_or_run(self, key, run_function):
+        result = self.get(key)
+        if result is None:
+            result = run_function()
+            self.put(key, result)
+        return result
+
+    # Method to delete the least recently used files until we're under the size limit
+    def evict(self):
+        with self._lock:
+            files = []
+            for path in self.cache_dir.glob("*/*.pkl"):
+                # The cache folder can be shared with other processes (e.g. the scenarios on
+                # the 'Compare Scenarios' page), so a file may be deleted between us finding it
+                # and checking its size
+                try:
+                    files.append((path.stat(), path))
+                except FileNotFoundError:
+                    continue
+            total_bytes = sum(file_stat.st_size for file_stat, _ in files)
+
+            # Sort so the least recently used file comes first
+            files.sort(key=lambda item: item[0].st_mtime)
+
+            for file_stat, path in files:
+                if total_bytes <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total_bytes -= file_stat.st_size
+                self.evictions += 1
+
+    # Method to delete everything in the cache
+    def clear(self):
+        for path in self.cache_dir.glob("*/*.pkl"):
+            path.unlink(missing_ok=True)
+
+    # Method to report on the current state of the cache
+    def stats(self):
+        sizes = []
+        for path in self.cache_dir.glob("*/*.pkl"):
+            try:
+                sizes.append(path.stat().st_size)
+            except FileNotFoundError:
+                continue
+        return {
+            "entries": len(sizes),
+            "disk_mb": sum(sizes) / (1024 * 1024),
+            "max_disk_mb": self.max_bytes / (1024 * 1024),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# Set up the g class in the same way des.py does from the app's sidebar inputs, then run the trial
+# (or fetch it from the cache)
+def warm_scenario(cache, walk_in_demand, calls_demand, sim_duration, number_of_runs, seed):
+    apply_scenario_parameters({
+        "patient_inter": sim_duration / walk_in_demand,
+        "call_inter": sim_duration / calls_demand,
+        "sim_duration": sim_duration,
+        "number_of_runs": number_of_runs,
+        "random_seed": seed,
+    })
+
+    key = make_cache_key(get_scenario_parameters())
+    if cache.get(key) is not None:
+        return key, False
+
+    cache.put(key, Trial().run_trial())
+    return key, True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the on-disk cache of trial results")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--max-mb", type=float, default=1024)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    warm_parser = subparsers.add_parser(
+        "warm", help="Run a scenario and save it to the cache (using the app's default inputs)"
+    )
+    warm_parser.add_argument("--walk-in-demand", type=float, default=150)
+    warm_parser.add_argument("--calls-demand", type=float, default=50)
+    warm_parser.add_argument("--sim-duration", type=int, default=g.sim_duration)
+    warm_parser.add_argument("--runs", type=int, default=g.number_of_runs)
+    warm_parser.add_argument("--seed", type=int, default=42)
+
+    subparsers.add_parser("stats", help="Show how much is stored in the cache")
+    subparsers.add_parser("clear", help="Delete everything in the cache")
+
+    args = parser.parse_args()
+
+    cache = TrialDiskCache(args.cache_dir, max_bytes=int(args.max_mb * 1024 * 1024))
+
+    if args.command == "warm":
+        start_time = time.perf_counter()
+        key, was_run = warm_scenario(
+            cache, args.walk_in_demand, args.calls_demand,
+            args.sim_duration, args.runs, args.seed
+        )
+        status = "Ran and cached" if was_run else "Already cached"
+        print(f"{status} scenario {key[:12]} in {time.perf_counter() - start_time:.1f} seconds")
+    elif args.command == "clear":
+        cache.clear()
+        print("Cache cleared")
+
+    for name, value in cache.stats().items():
+        print(f"{name}: {value:.1f}" if isinstance(value, float) else f"{name}: {value}")
+
+
+if __name__ == "__main__":
+    main()